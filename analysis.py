@@ -1,62 +1,88 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import requests
-import base64
-from io import StringIO
 import datetime
+import os
+from storage import create_storage, concat_typed
+from analytics import DEFAULT_CACHE_DIR, ROW_CATEGORIES, RollupCube, aging, rollup
+from forecast import LEAD_TIME_DAYS, forecast, reorder_point
+from ledger import Ledger
+from shards import ShardMap, fan_out, read_all
 
 # --- 設定 ---
 REPO_NAME = "iplan381/zaiko-kanri"
 FILE_PATH_LOG = "stock_log_main.csv"
-GITHUB_TOKEN = st.secrets["GITHUB_TOKEN"]
+FILE_PATH_STOCK = "inventory_main.csv"
 
 st.set_page_config(page_title="出庫分析システム", layout="wide")
+shard_map = ShardMap(st.secrets)
+
+@st.cache_resource
+def get_storage():
+    # app.py と同じく、ログは本体 + 月次セグメントをまとめて読む（拠点ごとのログも同じ）
+    return create_storage(st.secrets, REPO_NAME, segmented_paths=[FILE_PATH_LOG] + shard_map.paths(FILE_PATH_LOG))
+
+@st.cache_resource
+def get_cube(shard):
+    # 拠点ごとに全セッションで共有し、新しく追記されたログ行だけを足し込む。前処理の結果は .analytics_cache/ に残り、再起動後も続きから
+    return RollupCube(os.path.join(DEFAULT_CACHE_DIR, shard) if shard else DEFAULT_CACHE_DIR)
+
+@st.cache_data(max_entries=1)
+def get_forecast(_cube, watermark):
+    # 全 SKU の予測はログが増えた時だけ計算し直す（絞り込みを変えても再計算しない）
+    return forecast(_cube, end=pd.Timestamp.now())
+
+@st.cache_data(ttl=60)
+def get_logs(shards):
+    # 選んだ拠点のログを並列に、型付きで読む（日時は datetime64、数量は整数、商品名などは category）
+    storage = get_storage()
+    return fan_out(lambda shard: storage.read_typed(shard_map.path(FILE_PATH_LOG, shard))[0], shards)
 
 @st.cache_data(ttl=60)
-def get_github_data(file_path):
-    url = f"https://api.github.com/repos/{REPO_NAME}/contents/{file_path}"
-    headers = {"Authorization": f"token {GITHUB_TOKEN}"}
-    res = requests.get(url, headers=headers)
-    if res.status_code == 200:
-        content = res.json()
-        csv_text = base64.b64decode(content["content"]).decode("utf-8")
-        return pd.read_csv(StringIO(csv_text)).fillna("")
-    return pd.DataFrame()
-
-df_log_raw = get_github_data(FILE_PATH_LOG)
+def get_stock_data(shards):
+    return read_all(get_storage(), shard_map, FILE_PATH_STOCK, list(shards))
+
+@st.cache_resource(max_entries=1)
+def get_ledger(_df_log, shards, n_rows, last_ts):
+    # 拠点の選び方が変わった時と、ログが伸びた時（行数・最終日時が変わった時）だけ作り直す
+    return Ledger(_df_log)
+
+# 拠点（シャード）で分けている時は、見たい拠点のログだけを読む
+sel_shards = tuple(st.sidebar.multiselect("🏢 拠点", shard_map.names, default=shard_map.names)) if shard_map.enabled else ("",)
+logs = get_logs(sel_shards)
+df_log_raw = concat_typed(list(logs.values()))
 
 st.title("📈 階層別 在庫動態分析")
 
 if not df_log_raw.empty:
-    # --- データ前処理 ---
-    df = df_log_raw.copy()
-    df["日時"] = pd.to_datetime(df["日時"])
-    df["年"] = df["日時"].dt.year
-    df["月"] = df["日時"].dt.month
-    df["週"] = df["日時"].dt.isocalendar().week
-    df["数量"] = pd.to_numeric(df["数量"], errors='coerce').fillna(0)
-    
-    df_out_all = df[df["区分"].str.contains("出庫")].copy()
-    df_out_all["項目詳細"] = df_out_all["商品名"].astype(str) + " | " + df_out_all["サイズ"].astype(str) + " | " + df_out_all["地名"].astype(str)
+    # --- データ前処理（出庫を 日 × 項目詳細 に畳んだロールアップを差分更新） ---
+    # 拠点ごとのロールアップを足し合わせる（拠点ごとに差分だけを処理する）
+    cubes = [get_cube(shard) for shard in sel_shards]
+    for shard, c in zip(sel_shards, cubes):
+        c.refresh(logs[shard])
+    # 出庫の無い拠点の空の表（型なし）を混ぜると集計列が object になるので、中身のある表だけを足す
+    cube = pd.concat([c.daily for c in cubes if not c.daily.empty] or [cubes[0].daily], ignore_index=True)
+    cube_rows = concat_typed([c.rows for c in cubes], ROW_CATEGORIES)
+    last_moves = pd.concat([c.last_moves for c in cubes if not c.last_moves.empty] or [cubes[0].last_moves], ignore_index=True)
+    watermark = tuple((shard, c.rows_seen) for shard, c in zip(sel_shards, cubes))
 
     # --- 🔍 絞り込み条件（サイドバー） ---
     st.sidebar.header("🔍 絞り込み条件")
     
     # 【修正ポイント①】商品名・サイズ・地名の選択肢を、期間に関係なく全データから先に作っておく
-    all_item_list = ["すべて表示"] + sorted(df_out_all["商品名"].unique().tolist())
-    all_size_list = ["すべて表示"] + sorted(df_out_all["サイズ"].unique().tolist())
-    all_loc_list = ["すべて表示"] + sorted(df_out_all["地名"].unique().tolist())
+    all_item_list = ["すべて表示"] + sorted(cube["商品名"].unique().tolist())
+    all_size_list = ["すべて表示"] + sorted(cube["サイズ"].unique().tolist())
+    all_loc_list = ["すべて表示"] + sorted(cube["地名"].unique().tolist())
 
     # 年月の選択
-    year_list = sorted(df_out_all["年"].unique(), reverse=True)
+    year_list = sorted(cube["年"].unique(), reverse=True)
     sel_year = st.sidebar.selectbox("📅 ① 年を選択", year_list)
     
     month_options = ["すべて表示"] + [f"{m}月" for m in range(1, 13)]
     sel_month_str = st.sidebar.selectbox("📆 ② 月を選択", month_options)
 
     # 週の選択（ここは選択された月に依存するため動的に作成）
-    df_temp_month = df_out_all[(df_out_all["年"] == sel_year)]
+    df_temp_month = cube[(cube["年"] == sel_year)]
     sel_week_str = "すべて表示"
     if sel_month_str != "すべて表示":
         m_int = int(sel_month_str.replace("月", ""))
@@ -74,26 +100,24 @@ if not df_log_raw.empty:
 
     show_compare = st.sidebar.checkbox("🔄 昨年対比を表示する", value=True)
 
-    # --- 最終的なフィルタリング実行 ---
-    # 期間フィルタ
-    df_final = df_out_all[df_out_all["年"] == sel_year]
-    if sel_month_str != "すべて表示":
-        df_final = df_final[df_final["月"] == int(sel_month_str.replace("月", ""))]
-        if sel_week_str != "すべて表示":
-            df_final = df_final[df_final["週"] == int(sel_week_str.replace("第", "").replace("週", ""))]
-
-    # 商品・サイズ・地名フィルタ
-    if sel_item != "すべて表示": df_final = df_final[df_final["商品名"] == sel_item]
-    if sel_size != "すべて表示": df_final = df_final[df_final["サイズ"] == sel_size]
-    if sel_loc != "すべて表示": df_final = df_final[df_final["地名"] == sel_loc]
-
-    # 昨年対比用フィルタ
-    df_last = df_out_all[df_out_all["年"] == (sel_year - 1)]
-    if sel_month_str != "すべて表示":
-        df_last = df_last[df_last["月"] == int(sel_month_str.replace("月", ""))]
-    if sel_item != "すべて表示": df_last = df_last[df_last["商品名"] == sel_item]
-    if sel_size != "すべて表示": df_last = df_last[df_last["サイズ"] == sel_size]
-    if sel_loc != "すべて表示": df_last = df_last[df_last["地名"] == sel_loc]
+    def filter_period(df, year, with_week=True):
+        df = df[df["年"] == year]
+        if sel_month_str != "すべて表示":
+            df = df[df["月"] == int(sel_month_str.replace("月", ""))]
+            if with_week and sel_week_str != "すべて表示":
+                df = df[df["週"] == int(sel_week_str.replace("第", "").replace("週", ""))]
+        return df
+
+    def filter_items(df):
+        if sel_item != "すべて表示": df = df[df["商品名"] == sel_item]
+        if sel_size != "すべて表示": df = df[df["サイズ"] == sel_size]
+        if sel_loc != "すべて表示": df = df[df["地名"] == sel_loc]
+        return df
+
+    # --- 最終的なフィルタリング実行（期間 → 商品・サイズ・地名） ---
+    df_final = filter_items(filter_period(cube, sel_year))
+    # 昨年対比用（週は絞らない）
+    df_last = filter_items(filter_period(cube, sel_year - 1, with_week=False))
 
     st.divider()
 
@@ -113,13 +137,13 @@ if not df_log_raw.empty:
             k1, k2, k3 = st.columns(3)
             with k1: st.metric("期間内 合計出荷", f"{int(qty_this):,}")
             with k2: st.metric("稼働詳細項目数", f"{df_final['項目詳細'].nunique()}")
-            with k3: st.metric("平均出荷量", f"{round(df_final['数量'].mean(), 1)}")
+            with k3: st.metric("平均出荷量", f"{round(qty_this / df_final['件数'].sum(), 1)}")
 
         tab1, tab2, tab4, tab5 = st.tabs(["📊 傾向", "📈 トレンド推移", "⚠️ 不動・安全在庫", "🔢 履歴明細"])
 
         with tab1:
             st.subheader("📦 詳細項目別ランキング（上位20件）")
-            summary_rank = df_final.groupby("項目詳細")["数量"].sum().sort_values(ascending=True).tail(20).reset_index()
+            summary_rank = rollup(df_final, ["項目詳細"]).sort_values("数量", ascending=True).tail(20)
             fig_rank = px.bar(summary_rank, y="項目詳細", x="数量", orientation='h', text_auto=True, color="数量", color_continuous_scale=px.colors.sequential.Viridis)
             fig_rank.update_layout(coloraxis_showscale=False)
             st.plotly_chart(fig_rank, use_container_width=True)
@@ -127,10 +151,9 @@ if not df_log_raw.empty:
             c1, c2 = st.columns(2)
             with c1:
                 st.subheader("📍 地名別")
-                st.plotly_chart(px.pie(df_final, values='数量', names='地名', hole=0.4), use_container_width=True)
+                st.plotly_chart(px.pie(rollup(df_final, ["地名"]), values='数量', names='地名', hole=0.4), use_container_width=True)
             with c2:
                 st.subheader("📅 曜日別傾向 (クリックで内訳)")
-                df_final["曜日"] = df_final["日時"].dt.day_name()
                 day_jp = {'Monday':'月','Tuesday':'火','Wednesday':'水','Thursday':'木','Friday':'金','Saturday':'土','Sunday':'日'}
                 summary_day = df_final.groupby("曜日")["数量"].sum().reindex(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']).reset_index()
                 summary_day["表示曜日"] = summary_day["曜日"].map(day_jp)
@@ -147,36 +170,51 @@ if not df_log_raw.empty:
 
         with tab2:
             st.subheader("📈 トレンド推移")
-            df_trend = df_final.groupby(df_final["日時"].dt.date)["数量"].sum().reset_index()
+            df_trend = rollup(df_final, ["日付"]).rename(columns={"日付": "日時"})
             st.plotly_chart(px.line(df_trend, x="日時", y="数量", markers=True), use_container_width=True)
 
         with tab4:
             col_w1, col_w2 = st.columns(2)
             with col_w1:
                 st.subheader("⚠️ 不動在庫")
-                df_db = df_out_all.copy()
-                if sel_item != "すべて表示": df_db = df_db[df_db["商品名"] == sel_item]
-                if sel_size != "すべて表示": df_db = df_db[df_db["サイズ"] == sel_size]
-                if sel_loc != "すべて表示": df_db = df_db[df_db["地名"] == sel_loc]
-                
-                now = pd.Timestamp.now()
-                dead = df_db.groupby("項目詳細")["日時"].max().reset_index()
-                dead = dead.rename(columns={"日時": "最終出荷日"})
-                dead["経過日数"] = (now - dead["最終出荷日"]).dt.days
-                dead.loc[dead["経過日数"] < 0, "経過日数"] = 0
-                dead = dead.sort_values("経過日数", ascending=False)
-                dead["最終出荷日"] = dead["最終出荷日"].dt.strftime('%Y-%m-%d')
-                st.dataframe(dead, use_container_width=True, hide_index=True)
+                # 在庫表の全 SKU に最終入庫・最終出庫を付ける（一度も出庫の無い SKU も「未出庫」として出る）
+                dead = aging(get_stock_data(sel_shards), last_moves, pd.Timestamp.now())
+                dead = filter_items(dead[pd.to_numeric(dead["在庫数"], errors="coerce").fillna(0) > 0])
+                st.bar_chart(dead["滞留区分"].value_counts())
+                dead = dead.sort_values("滞留日数", ascending=False)
+                for c in ["最終入庫", "最終出庫"]:
+                    dead[c] = dead[c].dt.strftime('%Y-%m-%d')
+                st.dataframe(dead[["商品名", "サイズ", "地名", "在庫数", "最終入庫", "最終出庫", "滞留日数", "滞留区分"]], use_container_width=True, hide_index=True)
             with col_w2:
-                st.subheader("💡 推奨・安全在庫")
-                safety_df = df_final.groupby("項目詳細")["数量"].agg(['mean', 'std']).reset_index().fillna(0)
-                safety_df["推奨在庫"] = (safety_df["mean"] + 2 * safety_df["std"]).round(0)
-                st.dataframe(safety_df[["項目詳細", "推奨在庫"]].sort_values("推奨在庫", ascending=False), use_container_width=True, hide_index=True)
+                st.subheader("💡 推奨・安全在庫（発注点）")
+                lead_time = st.number_input("リードタイム（日）", min_value=1, value=LEAD_TIME_DAYS, key="lead_time")
+                safety_df = filter_items(get_forecast(cube, watermark))
+                safety_df = safety_df.assign(推奨在庫=reorder_point(safety_df, lead_time))
+                st.dataframe(safety_df[["項目詳細", "日次予測", "日次標準偏差", "推奨在庫"]].sort_values("推奨在庫", ascending=False), use_container_width=True, hide_index=True,
+                             column_config={"日次予測": st.column_config.NumberColumn(format="%.2f"), "日次標準偏差": st.column_config.NumberColumn(format="%.2f")})
 
         with tab5:
             st.subheader("🔢 履歴明細")
-            st.dataframe(df_final[["日時", "商品名", "サイズ", "地名", "数量"]].sort_values("日時", ascending=False), use_container_width=True, hide_index=True)
+            # 明細は前処理済みの出庫行（年・月・週 付き）から絞るので、元のログを読み直さない
+            df_hist = filter_items(filter_period(cube_rows, sel_year))
+            st.dataframe(df_hist[["日時", "商品名", "サイズ", "地名", "数量"]].sort_values("日時", ascending=False), use_container_width=True, hide_index=True)
     else:
         st.info("選択された条件に該当するデータがありません。")
+
+    # --- 🧮 棚卸（時点在庫） ---
+    st.divider()
+    st.subheader("🧮 棚卸（時点在庫）")
+    # 台帳はログ全体の再生なので、開いた時だけ作る（閉じている間の再実行では作らない）
+    if st.checkbox("棚卸を開く", value=False, key="ledger_open"):
+        ledger = get_ledger(df_log_raw, sel_shards, len(df_log_raw), str(df_log_raw["日時"].max()))
+        l1, l2 = st.columns(2)
+        with l1: snap_date = st.date_input("棚卸日（この日の終わり時点）", value=datetime.date.today(), key="ledger_date")
+        with l2: show_drift = st.checkbox("現在庫とのずれを表示", value=False)
+        snap = ledger.snapshot_at(pd.Timestamp(snap_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))
+        snap = filter_items(snap)
+        st.dataframe(snap.sort_values(["商品名", "サイズ", "地名"]), use_container_width=True, hide_index=True)
+        if show_drift:
+            st.caption("inventory_main.csv の在庫数と、ログを再生した在庫数が合わない SKU")
+            st.dataframe(ledger.stock_drift(get_stock_data(sel_shards)), use_container_width=True, hide_index=True)
 else:
     st.error("データの読み込みに失敗しました。")
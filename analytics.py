@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from storage import concat_typed
+
+# --- 出庫ロールアップ ---
+# analysis.py の各タブは「期間 × 商品・サイズ・地名」の出庫集計しか使わないので、
+# ログを1日 × 項目詳細の表（数量の合計・件数）に畳んで持ち、画面はここから答える。
+#
+# 前処理（年・月・週・項目詳細・出庫かどうか）は新しく追記された行にだけ行い、結果は cache_dir に保存する。
+# 次に起動した時は保存済みの分を読み、続きの行（watermark より後ろ）だけを処理する。
+# 同じ差分から SKU ごとの最終入庫・最終出庫日時（不動在庫・滞留日数用）も更新する。
+
+ITEM_KEYS = ["商品名", "サイズ", "地名"]
+ROW_COLUMNS = ["日時", "年", "月", "週"] + ITEM_KEYS + ["項目詳細", "数量"]
+ROW_CATEGORIES = ITEM_KEYS + ["項目詳細"]
+CUBE_KEYS = ["日付", "年", "月", "週", "曜日"] + ITEM_KEYS + ["項目詳細"]
+MEASURES = ["数量", "件数"]
+# 在庫が入ってきた記録（新規登録の数量は初期在庫）
+INBOUND_KINDS = ["入庫", "新規登録"]
+LAST_MOVE_COLUMNS = ITEM_KEYS + ["最終入庫", "最終出庫"]
+AGING_BUCKETS = [(30, "〜30日"), (90, "31〜90日"), (180, "91〜180日"), (None, "181日〜")]
+DEFAULT_CACHE_DIR = ".analytics_cache"
+
+
+def _categorical(series):
+    return series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype(str).astype("category")
+
+
+def prepare(df_log):
+    # 出庫行だけを取り出し、派生列を付ける。
+    # 区分の判定と 項目詳細 の文字列づくりは、行ごとではなくカテゴリ（種類）ごとに1回だけ行う
+    if df_log.empty:
+        return pd.DataFrame(columns=ROW_COLUMNS)
+    kind = _categorical(df_log["区分"])
+    is_out = np.asarray(kind.cat.categories.astype(str).str.contains("出庫"))[kind.cat.codes.to_numpy()]
+    is_out &= kind.cat.codes.to_numpy() >= 0
+    df = df_log[is_out & df_log["日時"].notna().to_numpy()]
+    if df.empty:
+        return pd.DataFrame(columns=ROW_COLUMNS)
+
+    items = {k: _categorical(df[k]) for k in ITEM_KEYS}
+    codes = np.stack([items[k].cat.codes.to_numpy() for k in ITEM_KEYS], axis=1)
+    uniq, inverse = np.unique(codes, axis=0, return_inverse=True)
+    labels = [
+        " | ".join(str(items[k].cat.categories[c]) for k, c in zip(ITEM_KEYS, row))
+        for row in uniq
+    ]
+    ts = df["日時"]
+    return pd.DataFrame({
+        "日時": ts.to_numpy(),
+        "年": ts.dt.year.to_numpy(),
+        "月": ts.dt.month.to_numpy(),
+        "週": ts.dt.isocalendar().week.to_numpy(dtype="int64"),
+        **{k: items[k].to_numpy() for k in ITEM_KEYS},
+        "項目詳細": pd.Categorical(np.asarray(labels, dtype=object)[inverse.ravel()]),
+        "数量": pd.to_numeric(df["数量"], errors="coerce").fillna(0).to_numpy(dtype="int64"),
+    }).astype({k: "category" for k in ITEM_KEYS})
+
+
+def last_movements(df_log):
+    # SKU ごとの最終入庫・最終出庫日時
+    df = df_log[df_log["日時"].notna()]
+    if df.empty:
+        return pd.DataFrame(columns=LAST_MOVE_COLUMNS)
+    kind = df["区分"].astype(str)
+    moves = df[ITEM_KEYS].astype(str).assign(
+        最終入庫=df["日時"].where(kind.isin(INBOUND_KINDS)),
+        最終出庫=df["日時"].where(kind.str.contains("出庫")),
+    )
+    return moves.groupby(ITEM_KEYS, as_index=False, sort=False)[["最終入庫", "最終出庫"]].max()
+
+
+def aging(df_stock, last_moves, now):
+    # inventory_main.csv の全行に最終入庫・最終出庫を付け、滞留日数と区分を出す。
+    # 一度も出庫の無い SKU は最終入庫（無ければ最終更新日）からの日数で数え、区分は「未出庫」
+    df = df_stock.copy()
+    keys = pd.MultiIndex.from_frame(df[ITEM_KEYS].astype(str))
+    moves = last_moves.set_index(ITEM_KEYS).reindex(keys)
+    df["最終入庫"] = moves["最終入庫"].to_numpy()
+    df["最終出庫"] = moves["最終出庫"].to_numpy()
+    since = df["最終出庫"].fillna(df["最終入庫"]).fillna(pd.to_datetime(df["最終更新日"], errors="coerce"))
+    df["滞留日数"] = (pd.Timestamp(now) - since).dt.days.clip(lower=0).astype("Int64")
+    days = df["滞留日数"].to_numpy(dtype="float64", na_value=np.nan)
+    bucket = np.full(len(df), AGING_BUCKETS[-1][1], dtype=object)
+    for limit, label in reversed(AGING_BUCKETS[:-1]):
+        bucket[days <= limit] = label
+    bucket[df["最終出庫"].isna().to_numpy()] = "未出庫"
+    df["滞留区分"] = bucket
+    return df
+
+
+def build_daily(rows):
+    # 前処理済みの出庫行を 1日 × 項目詳細 に集計する
+    if rows.empty:
+        return pd.DataFrame(columns=CUBE_KEYS + MEASURES)
+    daily = rows.assign(
+        日付=rows["日時"].dt.normalize(),
+        曜日=rows["日時"].dt.day_name(),
+        件数=1,
+    ).groupby(CUBE_KEYS, as_index=False, sort=False, observed=True)[MEASURES].sum()
+    return daily.astype({k: str for k in ITEM_KEYS + ["項目詳細"]})
+
+
+def rollup(daily, by):
+    # 日次の表を任意の粒度（["年", "週"], ["年", "月", "項目詳細"] など）に畳む
+    return daily.groupby(by, as_index=False, observed=True)[MEASURES].sum()
+
+
+class RollupCube:
+    # ログは追記専用なので、前回までに読んだ行数（watermark）より後ろの行だけを前処理・集計して足し込む。
+    # 行数が減った・watermark 直前の行が変わった時（書き換え・コンパクション）は作り直す
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.rows = pd.DataFrame(columns=ROW_COLUMNS)
+        self.daily = pd.DataFrame(columns=CUBE_KEYS + MEASURES)
+        self.last_moves = pd.DataFrame(columns=LAST_MOVE_COLUMNS)
+        self.rows_seen = 0
+        self._last_row = None
+
+    def refresh(self, df_log):
+        with self._lock:
+            if df_log.empty:
+                self._reset()
+                return self.daily
+            if len(df_log) < self.rows_seen or (self.rows_seen and self._row_key(df_log, self.rows_seen - 1) != self._last_row):
+                self._reset()
+            if len(df_log) > self.rows_seen:
+                chunk = df_log.iloc[self.rows_seen:]
+                moves = last_movements(chunk)
+                if not self.last_moves.empty:
+                    moves = pd.concat([self.last_moves, moves], ignore_index=True)
+                    moves = moves.groupby(ITEM_KEYS, as_index=False, sort=False)[["最終入庫", "最終出庫"]].max()
+                self.last_moves = moves
+                new = prepare(chunk)
+                if not new.empty:
+                    self.rows = concat_typed([self.rows, new], ROW_CATEGORIES)
+                    # 空の表（型なし）と結合すると集計列が object になるので、最初の差分はそのまま使う
+                    daily = build_daily(new)
+                    if not self.daily.empty:
+                        daily = pd.concat([self.daily, daily], ignore_index=True)
+                        daily = daily.groupby(CUBE_KEYS, as_index=False, sort=False)[MEASURES].sum()
+                    self.daily = daily
+                self.rows_seen = len(df_log)
+                self._last_row = self._row_key(df_log, self.rows_seen - 1)
+                self._save()
+            return self.daily
+
+    @staticmethod
+    def _row_key(df_log, i):
+        return [str(v) for v in df_log.iloc[i][["日時"] + ITEM_KEYS + ["区分", "数量"]]]
+
+    # --- 保存 / 読み込み ---
+    def _paths(self):
+        return {name: os.path.join(self.cache_dir, name) for name in ("rows.parquet", "daily.parquet", "last_moves.parquet", "state.json")}
+
+    def _save(self):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            paths = self._paths()
+            # 途中で落ちても壊れた組み合わせを読まないよう、state.json を最後に置き換える
+            for name, df in (("rows.parquet", self.rows), ("daily.parquet", self.daily), ("last_moves.parquet", self.last_moves)):
+                df.to_parquet(paths[name] + ".tmp", index=False)
+                os.replace(paths[name] + ".tmp", paths[name])
+            with open(paths["state.json"] + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"rows_seen": self.rows_seen, "last_row": self._last_row, "n_rows": len(self.rows)}, f, ensure_ascii=False)
+            os.replace(paths["state.json"] + ".tmp", paths["state.json"])
+        except (OSError, ImportError):
+            pass
+
+    def _load(self):
+        if not self.cache_dir:
+            return
+        paths = self._paths()
+        try:
+            with open(paths["state.json"], encoding="utf-8") as f:
+                state = json.load(f)
+            rows = pd.read_parquet(paths["rows.parquet"])
+            daily = pd.read_parquet(paths["daily.parquet"])
+            last_moves = pd.read_parquet(paths["last_moves.parquet"])
+        except (OSError, ValueError, ImportError):
+            return
+        # parquet だけ置き換わって state.json が古いまま（保存の途中で落ちた）なら使わずに作り直す
+        if state.get("n_rows") != len(rows):
+            return
+        self.rows, self.daily, self.last_moves = rows, daily, last_moves
+        self.rows_seen, self._last_row = state["rows_seen"], state["last_row"]
@@ -1,9 +1,13 @@
 import streamlit as st
 import pandas as pd
 import datetime as dt 
-import base64
-import requests
-from io import StringIO
+from storage import create_storage, fan_out
+from inventory import SKU_KEYS, LOG_COLUMNS, MOVEMENT_SIGNS, MOVED_FROM_COLUMN, EffectiveStock, build_sku_index, rekey_sku, sku_of, apply_movements
+from analytics import build_daily, prepare
+from forecast import suggested_alerts
+from bulk import apply_import, iter_csv, read_movements
+from shards import ShardMap, read_all
+from tracing import Tracer, configure_logging
 
 def get_now_jst():
     return dt.datetime.now(dt.timezone(dt.timedelta(hours=9))).strftime("%Y-%m-%d %H:%M")
@@ -13,82 +17,162 @@ REPO_NAME = "iplan381/zaiko-kanri"
 FILE_PATH_STOCK = "inventory_main.csv"
 FILE_PATH_LOG = "stock_log_main.csv"
 FILE_PATH_RESERVATION = "reservations_main.csv"
-GITHUB_TOKEN = st.secrets["GITHUB_TOKEN"]
 
 SIZES_MASTER = ["大", "中", "小", "4個入", " - "]
 VENDORS_MASTER = ["富士山", "東山観光", "モンテリア", "ベーカリー"]
 USERS = ["佐藤", "手塚", "檀原"]
+PAGE_SIZES = [50, 100, 200, 500]
+# 起動時に読むログは直近この日数だけ（それより前は履歴の期間選択で選んだ時に取りに行く）
+LOG_WINDOW_DAYS = 90
 
 st.set_page_config(page_title="在庫管理システム", layout="wide")
 
-# --- 2. GitHub関数 ---
-def get_github_data(file_path):
-    url = f"https://api.github.com/repos/{REPO_NAME}/contents/{file_path}"
-    headers = {"Authorization": f"token {GITHUB_TOKEN}"}
-    res = requests.get(url, headers=headers)
-    if res.status_code == 200:
-        content = res.json()
-        csv_text = base64.b64decode(content["content"]).decode("utf-8")
-        df = pd.read_csv(StringIO(csv_text))
-        return df.fillna(""), content["sha"]
-    return pd.DataFrame(), None
+# 再実行ごとの処理時間の計測。?debug=1（または secrets の DEBUG_TRACE）でサイドバーに表示、TRACE_LOG で JSON ログに出す
+tracer = Tracer("rerun", page="app")
+SHOW_TRACE = st.query_params.get("debug") == "1" or bool(st.secrets.get("DEBUG_TRACE", False))
+if st.secrets.get("TRACE_LOG", False):
+    configure_logging()
+
+# --- 2. データアクセス関数（保存先は secrets の STORAGE_BACKEND で切替） ---
+shard_map = ShardMap(st.secrets)
+
+@st.cache_resource
+def get_storage():
+    # 入出庫ログは追記専用（GitHub では月次セグメントに追記）。拠点ごとのログも同じ
+    return create_storage(st.secrets, REPO_NAME, segmented_paths=[FILE_PATH_LOG] + shard_map.paths(FILE_PATH_LOG))
 
 def update_github_data(file_path, df, sha, message):
-    url = f"https://api.github.com/repos/{REPO_NAME}/contents/{file_path}"
-    headers = {"Authorization": f"token {GITHUB_TOKEN}"}
-    csv_content = df.to_csv(index=False)
-    data = {
-        "message": message,
-        "content": base64.b64encode(csv_content.encode("utf-8")).decode("utf-8"),
-        "sha": sha
-    }
-    res = requests.put(url, headers=headers, json=data)
-    return res.status_code == 200
-
-# 予約を自動処理する関数
-def process_reservations(df_stock, sha_stock, df_log, sha_log):
-    df_res, sha_res = get_github_data(FILE_PATH_RESERVATION)
-    if df_res.empty: return df_stock, df_log
-    today = dt.datetime.now(dt.timezone(dt.timedelta(hours=9))).date()
-    df_res["予約日_dt"] = pd.to_datetime(df_res["予約日"]).dt.date
-    to_process = df_res[df_res["予約日_dt"] <= today]
-    if not to_process.empty:
-        new_logs = []
-        for _, row in to_process.iterrows():
-            mask = (df_stock["商品名"] == row["商品名"]) & (df_stock["サイズ"] == row["サイズ"]) & (df_stock["地名"] == row["地名"])
-            if mask.any():
-                idx = df_stock[mask].index[0]
-                df_stock.at[idx, "在庫数"] -= row["数量"]
-                df_stock.at[idx, "最終更新日"] = get_now_jst()
-                new_logs.append({
-                    "日時": get_now_jst(), "商品名": row["商品名"], "サイズ": row["サイズ"], 
-                    "地名": row["地名"], "区分": "出庫(予約実行)", "数量": row["数量"], 
-                    "在庫数": df_stock.at[idx, "在庫数"], "担当者": row["担当者"]
-                })
-        df_res_remain = df_res[df_res["予約日_dt"] > today].drop(columns=["予約日_dt"])
-        update_github_data(FILE_PATH_STOCK, df_stock, sha_stock, "Auto Reservation Exec")
-        update_github_data(FILE_PATH_LOG, pd.concat([df_log, pd.DataFrame(new_logs)], ignore_index=True), sha_log, "Auto Res Log")
-        update_github_data(FILE_PATH_RESERVATION, df_res_remain, sha_res, "Clean up Reservation")
-        st.success(f"📢 本日の出庫予約を在庫に反映しました")
-        st.rerun()
-    return df_stock, df_log
+    return tracer.call("write", get_storage().write, file_path, df, sha, message, path=file_path, message=message)
+
+def commit_github_data(file_paths, build, message):
+    # 在庫・ログ・予約をまとめて1回で更新する。他の人と衝突したら最新データで build をやり直す
+    return tracer.call("commit", get_storage().transact, file_paths, build, message, message=message)
+
+def rerun_after_write():
+    # st.rerun() はここで処理を打ち切るので、書き込みを含む計測はその前にログへ出し、次の再実行の表示用に残す
+    tracer.emit()
+    st.session_state.write_trace = (tracer.total_ms, tracer.spans)
+    st.rerun()
+
+def apply_batch(df_stock, update_payload, user_name, now):
+    # 一括操作パネルの内容を在庫表に当てて (在庫表, ログ行, 予約行) を返す。
+    # 衝突時は最新の在庫表でもう一度呼ばれるので、数量は「差分」として扱う
+    sku_index = build_sku_index(df_stock)
+    new_logs, new_reservations, stock_deletes, moves, edits = [], [], [], [], []
+    # 1) 操作を「削除」「予約」「数量の増減」「地名・基準の変更」に振り分ける
+    for idx, p in update_payload.items():
+        row = p["orig_data"]
+        sku = sku_of(row)
+        if sku not in sku_index:
+            continue
+        if p["delete"]:
+            stock_deletes.append(sku)
+            new_logs.append({"日時": now, "商品名": row["商品名"], "サイズ": row["サイズ"], "地名": row["地名"], "区分": "削除", "数量": 0, "在庫数": 0, "担当者": user_name})
+        elif p["type"] == "予約出庫" and p["qty"] > 0:
+            new_reservations.append({"予約日": p["res_date"], "商品名": row["商品名"], "サイズ": row["サイズ"], "地名": row["地名"], "数量": p["qty"], "担当者": user_name})
+        elif p["type"] != "変更なし":
+            edits.append((sku, p))
+            if p["type"] in MOVEMENT_SIGNS and p["qty"] != 0:
+                moves.append({"商品名": row["商品名"], "サイズ": row["サイズ"], "地名": row["地名"], "区分": p["type"], "数量": p["qty"], "担当者": user_name})
+
+    # 2) 数量の増減は SKU ごとにまとめて一度に反映
+    df_stock, df_move_logs = apply_movements(df_stock, pd.DataFrame(moves), now)
+    new_locs = {sku: p["loc"] for sku, p in edits}
+    if not df_move_logs.empty:
+        df_move_logs["地名"] = [new_locs.get(k, k[2]) for k in zip(*(df_move_logs[c] for c in SKU_KEYS))]
+        new_logs.extend(df_move_logs.to_dict("records"))
+
+    # 3) 地名・アラート基準の変更（ログの地名は変更後の地名）
+    if edits:
+        df_stock = df_stock.copy()
+    for sku, p in edits:
+        orig_idx = sku_index[sku]
+        df_stock.at[orig_idx, "地名"], df_stock.at[orig_idx, "アラート基準"], df_stock.at[orig_idx, "最終更新日"] = p["loc"], p["alert"], now
+        rekey_sku(sku_index, sku, (sku[0], sku[1], p["loc"]))
+        if p["loc"] != sku[2]:
+            new_logs.append({"日時": now, "商品名": sku[0], "サイズ": sku[1], "地名": p["loc"], "区分": "地名変更", "数量": 0, "在庫数": df_stock.at[orig_idx, "在庫数"], "担当者": user_name, MOVED_FROM_COLUMN: sku[2]})
+    df_stock = df_stock.drop([sku_index.pop(sku) for sku in set(stock_deletes) if sku in sku_index])
+    return df_stock, pd.DataFrame(new_logs), pd.DataFrame(new_reservations)
 
 def get_opts(series):
     items = sorted([str(x) for x in series.unique() if str(x).strip() != ""])
     return ["すべて"] + items
 
-def highlight_alert(row):
-    styles = [''] * len(row)
-    # アラート判定を「有効在庫」で行う
-    if "有効在庫" in row.index and row["有効在庫"] < row["アラート基準"]:
-        return ['background-color: #d9534f; color: white'] * len(row)
+def highlight_alert(df, alert_mask):
+    # アラート判定（有効在庫 < アラート基準）は EffectiveStock で済ませてあるので、行ごとの判定はしない
+    styles = pd.DataFrame('', index=df.index, columns=df.columns)
+    styles.loc[alert_mask.reindex(df.index, fill_value=False).astype(bool)] = 'background-color: #d9534f; color: white'
     return styles
 
+def paginate(df, key, sort_options, default_sort, ascending=False):
+    # 並び替え・ページ切り出しはサーバー側で行い、表示する1ページ分だけを整形・送信する
+    p1, p2, p3, p4 = st.columns([2, 1, 1, 1])
+    with p1: sort_col = st.selectbox("並び替え", sort_options, index=sort_options.index(default_sort), key=f"{key}_sort")
+    with p2: asc = st.checkbox("昇順", value=ascending, key=f"{key}_asc")
+    with p3: page_size = st.selectbox("表示件数", PAGE_SIZES, key=f"{key}_size")
+    n_pages = max(1, -(-len(df) // page_size))
+    # 絞り込みで件数が減った時にページ番号が範囲外にならないよう、ウィジェット作成前に詰める
+    if st.session_state.get(f"{key}_page", 1) > n_pages:
+        st.session_state[f"{key}_page"] = n_pages
+    with p4: page = st.number_input(f"ページ（全{n_pages}）", min_value=1, max_value=n_pages, value=1, key=f"{key}_page")
+    start = (int(page) - 1) * page_size
+    return df.sort_values(sort_col, ascending=asc, kind="stable").iloc[start:start + page_size]
+
+def export_button(df, file_name, key):
+    # CSV は「書き出し」を押した再実行でだけ作る（押さない限り、絞り込んだ全件を毎回変換しない）
+    if st.button("📤 絞り込み結果を CSV で書き出す", key=f"{key}_prepare"):
+        with tracer.span(key, rows=len(df)):
+            data = b"".join(iter_csv(df))
+        st.download_button("⬇️ CSV をダウンロード", data, file_name=file_name, mime="text/csv", key=key)
+
+@st.cache_data(max_entries=1)
+def get_suggested_alerts(_df_log, path_log, sha_log):
+    # アラート基準の推奨値（発注点）。ログが変わった時だけ全 SKU をまとめて計算し直す
+    return suggested_alerts(build_daily(prepare(_df_log)), end=pd.Timestamp.now())
+
+@st.cache_data(ttl=60, max_entries=4)
+def get_log_range(file_path, start, end, sha):
+    # 起動時に読んでいない古い期間のログ。アーカイブ済みの月は期間に重なるブロックだけを取りに行く
+    return get_storage().read_range(file_path, start=start, end=end)[0]
+
+@st.cache_data(ttl=60, max_entries=4)
+def get_log_span(file_path, sha):
+    # 履歴の期間選択で選べる範囲（アーカイブ済みの月も含めたログ全体の最初と最後）
+    return get_storage().time_span(file_path)
+
+def get_effective_stock(df_stock, stock_version, df_res, res_version):
+    # 有効在庫の表はセッションに1つ持ち、版が変わった側（在庫 or 予約）だけを差し替える。
+    # 版は (パス, sha)。SQLite の sha はテーブルごとの番号で拠点が違っても同じ値になり得るので、パスも含める
+    view, versions = st.session_state.get("effective_stock", (None, (None, None)))
+    if view is None or view.table.empty:
+        view = EffectiveStock(df_stock, df_res)
+    else:
+        if versions[0] != stock_version: view.set_stock(df_stock)
+        if versions[1] != res_version: view.set_reservations(df_res)
+    st.session_state.effective_stock = (view, (stock_version, res_version))
+    return view
+
+# 拠点（シャード）で分けている時は、選んだ拠点のファイルだけを読み書きする。分けていなければ従来の1ファイル
+shard = st.sidebar.selectbox("🏢 拠点", shard_map.names, key="shard") if shard_map.enabled else ""
+path_stock, path_log, path_res = (shard_map.path(p, shard) for p in (FILE_PATH_STOCK, FILE_PATH_LOG, FILE_PATH_RESERVATION))
+
 # データ読み込み
-df_stock, sha_stock = get_github_data(FILE_PATH_STOCK)
-df_log, sha_log = get_github_data(FILE_PATH_LOG)
-df_res_all, sha_res_all = get_github_data(FILE_PATH_RESERVATION)
-df_stock, df_log = process_reservations(df_stock, sha_stock, df_log, sha_log)
+# 在庫・ログ・予約は互いに依存しないので並列に取ってくる（待ち時間は3往復の合計ではなく一番遅い1本分）。
+# ログは型付き（日時=datetime, 数量/在庫数=整数, 文字列=category）で、直近 LOG_WINDOW_DAYS 日分だけ読む。
+# get_storage() はスレッドの外で先に取っておく（st.cache_resource はスクリプトのスレッドから呼ぶ）
+storage = get_storage()
+today_jst = dt.datetime.now(dt.timezone(dt.timedelta(hours=9))).date()
+log_start = pd.Timestamp(today_jst - dt.timedelta(days=LOG_WINDOW_DAYS))
+loaders = {path_stock: storage.read, path_log: lambda p: storage.read_range(p, start=log_start), path_res: storage.read}
+loaded = fan_out(lambda path: tracer.call("load", loaders[path], path, path=path), loaders)
+(df_stock, sha_stock), (df_log, sha_log), (df_res_all, sha_res_all) = (loaded[p] for p in (path_stock, path_log, path_res))
+if df_log.empty:
+    # 直近に動きが無くても、履歴の絞り込み・表示が列を前提にできるように
+    df_log = pd.DataFrame(columns=LOG_COLUMNS)
+# 予約の実行は reservation_worker（cron などで1日1回）が行う。画面は結果を読むだけ
+if not df_res_all.empty and (pd.to_datetime(df_res_all["予約日"]).dt.date < today_jst).any():
+    st.warning("⚠️ 予約日を過ぎた未実行の予約があります。予約実行ワーカー（python -m reservation_worker）の稼働を確認してください")
+sku_index = build_sku_index(df_stock)
 
 # --- 3. サイドバー：新規商品登録 ---
 with st.sidebar:
@@ -101,17 +185,34 @@ with st.sidebar:
     n_alert = st.number_input("アラート基準", min_value=0, value=5, key="sidebar_n_alert")
     
     if st.button("新規登録実行", use_container_width=True, type="primary"):
-        is_duplicate = not df_stock[(df_stock["商品名"] == n_item) & (df_stock["サイズ"] == n_size) & (df_stock["地名"] == n_loc)].empty
+        is_duplicate = (n_item, n_size, n_loc) in sku_index
         if is_duplicate:
             st.error(f"❌ 重複エラー")
         elif n_item and n_loc:
             now = get_now_jst()
             new_row = pd.DataFrame([{"最終更新日": now, "商品名": n_item, "サイズ": n_size, "地名": n_loc, "在庫数": n_stock, "アラート基準": n_alert, "取引先": n_vendor}])
             new_log = pd.DataFrame([{"日時": now, "商品名": n_item, "サイズ": n_size, "地名": n_loc, "区分": "新規登録", "数量": n_stock, "在庫数": n_stock, "担当者": "システム"}])
-            if update_github_data(FILE_PATH_STOCK, pd.concat([df_stock, new_row], ignore_index=True), sha_stock, "Add Item") and \
-               update_github_data(FILE_PATH_LOG, pd.concat([df_log, pd.DataFrame(new_log)], ignore_index=True), sha_log, "Add Log"):
+            raced = []
+            # 登録先の拠点は地名（または取引先）で決まる。いま開いている拠点と違えばそちらのファイルに入る
+            target = shard_map.shard_of(n_vendor if shard_map.by == "取引先" else n_loc)
+            reg_stock, reg_log = shard_map.path(FILE_PATH_STOCK, target), shard_map.path(FILE_PATH_LOG, target)
+
+            def build(frames):
+                # 画面を開いた後に他の人が同じ商品を登録していたら何もしない
+                if (n_item, n_size, n_loc) in build_sku_index(frames[reg_stock]):
+                    raced.append(True)
+                    return {}
+                return {reg_stock: ("append", new_row), reg_log: ("append", new_log)}
+
+            if not commit_github_data([reg_stock], build, "Add Item"):
+                st.error("❌ 登録に失敗しました。時間をおいて再度お試しください")
+            elif raced:
+                st.error(f"❌ 重複エラー")
+            elif target != shard:
+                st.success(f"登録完了（拠点: {target}）")
+            else:
                 st.success("登録完了")
-                st.rerun()
+                rerun_after_write()
 
 # --- 4. メイン：在庫一覧 ---
 st.title("📦 在庫管理")
@@ -122,30 +223,47 @@ with c2: s_size = st.selectbox("検索:サイズ", get_opts(df_stock["サイズ"
 with c3: search_loc = st.text_input("検索:地名（手入力）", placeholder="例: 青森", key="filter_loc")
 with c4: s_vendor = st.selectbox("検索:取引先", get_opts(df_stock["取引先"]), key="filter_vendor")
 
-# 有効在庫の計算
-df_disp = df_stock.copy()
-res_sum = df_res_all.groupby(["商品名", "サイズ", "地名"])["数量"].sum().reset_index().rename(columns={"数量": "予約計"})
-df_disp = pd.merge(df_disp, res_sum, on=["商品名", "サイズ", "地名"], how="left").fillna({"予約計": 0})
-df_disp["有効在庫"] = df_disp["在庫数"] - df_disp["予約計"]
+# 有効在庫（一覧と予約リストで共用）
+with tracer.span("effective_stock", rows=len(df_stock)):
+    effective = get_effective_stock(df_stock, (path_stock, sha_stock), df_res_all, (path_res, sha_res_all))
+    df_disp = effective.join(df_stock, ["有効在庫", "アラート"])
+# 出庫実績のある SKU には推奨アラート基準を並べる（一括操作パネルの入力欄にも表示）
+suggested = tracer.call("suggested_alerts", get_suggested_alerts, df_log, path_log, sha_log)
+df_disp["推奨基準"] = suggested.reindex(pd.MultiIndex.from_frame(df_disp[SKU_KEYS].astype(str))).to_numpy()
+df_disp["推奨基準"] = df_disp["推奨基準"].astype("Int64")
 
 # フィルタリング
-if s_item != "すべて": df_disp = df_disp[df_disp["商品名"] == s_item]
-if s_size != "すべて": df_disp = df_disp[df_disp["サイズ"] == s_size]
-if search_loc.strip(): df_disp = df_disp[df_disp["地名"].astype(str).str.contains(search_loc, na=False)]
-if s_vendor != "すべて": df_disp = df_disp[df_disp["取引先"] == s_vendor]
+with tracer.span("filter_stock") as trace_filter:
+    if s_item != "すべて": df_disp = df_disp[df_disp["商品名"] == s_item]
+    if s_size != "すべて": df_disp = df_disp[df_disp["サイズ"] == s_size]
+    if search_loc.strip(): df_disp = df_disp[df_disp["地名"].astype(str).str.contains(search_loc, na=False)]
+    if s_vendor != "すべて": df_disp = df_disp[df_disp["取引先"] == s_vendor]
+    trace_filter["rows"] = len(df_disp)
 
 # 表示列の整理
-disp_cols = ["最終更新日", "商品名", "サイズ", "地名", "在庫数", "有効在庫", "アラート基準", "取引先"]
-df_show = df_disp[disp_cols].sort_values("最終更新日", ascending=False)
-styled_df = df_show.style.apply(highlight_alert, axis=1)
-
-event = st.dataframe(
-    styled_df, use_container_width=True, hide_index=True, on_select="rerun", selection_mode="multi-row",
-    column_config={
-        "在庫数": st.column_config.NumberColumn("実在庫", format="%d"),
-        "有効在庫": st.column_config.NumberColumn("有効在庫", format="%d")
-    }
-)
+disp_cols = ["最終更新日", "商品名", "サイズ", "地名", "在庫数", "有効在庫", "アラート基準", "推奨基準", "取引先"]
+df_show = paginate(df_disp[disp_cols], "stock_page", disp_cols, "最終更新日")
+export_button(df_disp[disp_cols], "inventory.csv", "export_stock")
+
+with tracer.span("render_stock", rows=len(df_show)):
+    styled_df = df_show.style.apply(highlight_alert, axis=None, alert_mask=df_disp["アラート"])
+    event = st.dataframe(
+        styled_df, use_container_width=True, hide_index=True, on_select="rerun", selection_mode="multi-row",
+        column_config={
+            "在庫数": st.column_config.NumberColumn("実在庫", format="%d"),
+            "有効在庫": st.column_config.NumberColumn("有効在庫", format="%d")
+        }
+    )
+
+# 全拠点の在庫（拠点ごとのファイルを並列に読む。表示だけで、変更は各拠点を開いて行う）
+if shard_map.enabled:
+    with st.expander("🏢 全拠点の在庫"):
+        df_all_shards = read_all(get_storage(), shard_map, FILE_PATH_STOCK, label="拠点")
+        if df_all_shards.empty:
+            st.write("データがありません")
+        else:
+            df_all_shards["在庫数"] = pd.to_numeric(df_all_shards["在庫数"], errors="coerce").fillna(0).astype(int)
+            st.dataframe(df_all_shards.pivot_table(index=["商品名", "サイズ"], columns="拠点", values="在庫数", aggfunc="sum", fill_value=0), use_container_width=True)
 
 # --- 5. 操作パネル ---
 st.divider()
@@ -173,65 +291,65 @@ if selected_indices:
                         res_date = st.date_input("予約日", value=dt.date.today() + dt.timedelta(days=1), key=f"date_{i}")
                     else:
                         new_loc = st.text_input("地名変更", value=row['地名'], key=f"loc_{i}")
-                with col4: new_alert = st.number_input("アラート基準", min_value=0, value=int(row['アラート基準']), key=f"alt_{i}")
+                with col4: new_alert = st.number_input("アラート基準", min_value=0, value=int(row['アラート基準']), key=f"alt_{i}", help=None if pd.isna(row['推奨基準']) else f"推奨（発注点）: {row['推奨基準']}")
                 with col5: is_delete = st.checkbox("削除", key=f"del_{i}")
                 update_payload[i] = {"type": m_type, "qty": m_qty, "loc": new_loc if m_type != "予約出庫" else row['地名'], "alert": new_alert, "delete": is_delete, "res_date": res_date if m_type == "予約出庫" else None, "orig_data": row}
 
         if st.button("🔄 全ての変更を確定する", type="primary", use_container_width=True):
             st.session_state.last_user = user_name
-            now, new_logs, new_reservations = get_now_jst(), [], []
-            for idx, p in update_payload.items():
-                row = p["orig_data"]
-                target_mask = (df_stock["商品名"] == row["商品名"]) & (df_stock["サイズ"] == row["サイズ"]) & (df_stock["地名"] == row["地名"])
-                if target_mask.any():
-                    orig_idx = df_stock[target_mask].index[0]
-                    if p["delete"]:
-                        df_stock = df_stock.drop(orig_idx)
-                        new_logs.append({"日時": now, "商品名": row["商品名"], "サイズ": row["サイズ"], "地名": row["地名"], "区分": "削除", "数量": 0, "在庫数": 0, "担当者": user_name})
-                    elif p["type"] == "予約出庫" and p["qty"] > 0:
-                        new_reservations.append({"予約日": p["res_date"], "商品名": row["商品名"], "サイズ": row["サイズ"], "地名": row["地名"], "数量": p["qty"], "担当者": user_name})
-                    elif p["type"] != "変更なし":
-                        if p["type"] == "入庫" or p["type"] == "調整":
-                            df_stock.at[orig_idx, "在庫数"] += p["qty"]
-                        elif p["type"] == "出庫":
-                            df_stock.at[orig_idx, "在庫数"] -= p["qty"]
-        
-                        df_stock.at[orig_idx, "地名"], df_stock.at[orig_idx, "アラート基準"], df_stock.at[orig_idx, "最終更新日"] = p["loc"], p["alert"], now
-                        
-                        curr_stock = df_stock.at[orig_idx, "在庫数"]
-                        if p["qty"] != 0: 
-                            new_logs.append({"日時": now, "商品名": row["商品名"], "サイズ": row["サイズ"], "地名": p["loc"], "区分": p["type"], "数量": p["qty"], "在庫数": curr_stock, "担当者": user_name})
-                        if p["loc"] != row["地名"]: 
-                            new_logs.append({"日時": now, "商品名": row["商品名"], "サイズ": row["サイズ"], "地名": p["loc"], "区分": "地名変更", "数量": 0, "在庫数": curr_stock, "担当者": user_name})
-                
-            update_github_data(FILE_PATH_STOCK, df_stock, sha_stock, "Batch Update")
-            if new_logs: update_github_data(FILE_PATH_LOG, pd.concat([df_log, pd.DataFrame(new_logs)], ignore_index=True), sha_log, "Log Update")
-            if new_reservations:
-                df_res_old, sha_res = get_github_data(FILE_PATH_RESERVATION)
-                update_github_data(FILE_PATH_RESERVATION, pd.concat([df_res_old, pd.DataFrame(new_reservations)], ignore_index=True), sha_res, "Add Reservation")
-            st.rerun()
+            now = get_now_jst()
+
+            def build(frames):
+                df_new_stock, df_new_logs, df_new_res = apply_batch(frames[path_stock], update_payload, user_name, now)
+                changes = {path_stock: ("write", df_new_stock)}
+                if not df_new_logs.empty: changes[path_log] = ("append", df_new_logs)
+                if not df_new_res.empty: changes[path_res] = ("append", df_new_res)
+                return changes
+
+            if commit_github_data([path_stock, path_res], build, "Batch Update"):
+                rerun_after_write()
+            st.error("❌ 他の人の更新と競合したため保存できませんでした。再読み込みしてやり直してください")
 else:
     st.info("💡 **一覧で複数チェックを入れると、一括操作パネルが表示されます。**")
 
+# 行数の多い入出庫はファイルで一括取込（エラーが1行でもあれば反映しない）
+with st.expander("📥 入出庫の一括取込（CSV / Excel）"):
+    st.caption("列: 区分（入庫/出庫/予約出庫/調整）, 商品名, サイズ, 地名, 数量, 予約日（予約出庫のみ）, 取引先・担当者（任意）")
+    up_file = st.file_uploader("ファイルを選択", type=["csv", "xlsx", "xlsm"], key="bulk_file")
+    up_user = st.selectbox("担当者（ファイルで空欄の行）", ["-- 選択 --"] + USERS, key="bulk_user")
+    if up_file is not None and up_user != "-- 選択 --":
+        df_up, df_up_errors = read_movements(up_file, up_file.name, sku_index, SIZES_MASTER, VENDORS_MASTER, USERS, up_user)
+        if not df_up_errors.empty:
+            st.error(f"❌ {len(df_up_errors):,} 行にエラーがあります。修正して取り込み直してください")
+            st.dataframe(df_up_errors, use_container_width=True, hide_index=True)
+        elif df_up.empty:
+            st.info("取り込む行がありません")
+        else:
+            st.success(f"{len(df_up):,} 行を取り込めます")
+            st.dataframe(df_up["区分"].value_counts(), use_container_width=True)
+            if st.button("📥 取込を確定する", type="primary", use_container_width=True):
+                now = get_now_jst()
+
+                def build(frames):
+                    df_new_stock, df_new_logs, df_new_res = apply_import(frames[path_stock], df_up, now)
+                    changes = {path_stock: ("write", df_new_stock)}
+                    if not df_new_logs.empty: changes[path_log] = ("append", df_new_logs)
+                    if not df_new_res.empty: changes[path_res] = ("append", df_new_res)
+                    return changes
+
+                if commit_github_data([path_stock, path_res], build, "Bulk Import"):
+                    rerun_after_write()
+                st.error("❌ 他の人の更新と競合したため保存できませんでした。再読み込みしてやり直してください")
+
 # --- 6. 予約・履歴（縦並びに変更） ---
 st.divider()
 
 # --- A. 出庫予約リスト ---
 st.subheader("📅 出庫予約リスト")
 if not df_res_all.empty:
-    # --- 修正ポイント：絞り込み前の全在庫データ(all_stocks)を作成して紐付ける ---
-    # メインの df_disp は検索で中身が減るため、ここでは使いません
-    res_sum_all = df_res_all.groupby(["商品名", "サイズ", "地名"])["数量"].sum().reset_index().rename(columns={"数量": "予約計"})
-    all_stocks = pd.merge(df_stock, res_sum_all, on=["商品名", "サイズ", "地名"], how="left").fillna({"予約計": 0})
-    all_stocks["有効在庫"] = all_stocks["在庫数"] - all_stocks["予約計"]
-
-    # 予約データに、この「全在庫データ」を紐付ける
-    df_rv = pd.merge(
-        df_res_all, 
-        all_stocks[["商品名", "サイズ", "地名", "在庫数", "有効在庫"]], 
-        on=["商品名", "サイズ", "地名"], 
-        how="left"
-    ).fillna({"在庫数": 0, "有効在庫": 0})
+    # 予約データに、絞り込み前の全在庫の有効在庫を紐付ける
+    # （メインの df_disp は検索で中身が減るため、ここでは使いません）
+    df_rv = effective.join(df_res_all, ["在庫数", "有効在庫"])
     
     # 予約リスト専用の絞り込み（これは残しておきます）
     res_filter_item = st.selectbox("予約検索:商品名", get_opts(df_rv["商品名"]), key="res_f_item")
@@ -284,9 +402,11 @@ if not df_res_all.empty:
                     new_df_res.at[o_idx, "数量"] = val["qty"]
             if indices_to_drop:
                 new_df_res = new_df_res.drop(indices_to_drop)
-            update_github_data(FILE_PATH_RESERVATION, new_df_res, sha_res_all, "Individual Res Update Fix")
-            st.success("予約を更新しました")
-            st.rerun()
+            if update_github_data(path_res, new_df_res, sha_res_all, "Individual Res Update Fix"):
+                st.success("予約を更新しました")
+                rerun_after_write()
+            else:
+                st.error("❌ 他の人が予約を更新したため保存できませんでした。再読み込みしてやり直してください")
     else:
         st.info("💡 編集・削除したい予約の左側にチェックを入れてください。")
 else:
@@ -297,17 +417,19 @@ st.divider() # 予約と履歴の間に区切り線を入れる
 # --- B. 入出庫履歴 ---
 st.subheader("📜 入出庫履歴")
 
-if not df_log.empty:
+log_first, log_last = get_log_span(path_log, sha_log)
+if log_first is not None:
     # 1. フィルター設置
     col_log1, col_log2 = st.columns(2)
     with col_log1:
-        df_log["日時"] = pd.to_datetime(df_log["日時"])
-        min_date = df_log["日時"].min().date()
-        max_date = df_log["日時"].max().date()
-        log_date_range = st.date_input("期間選択", value=(min_date, max_date), key="log_date_filter")
+        # 選べるのはアーカイブも含めたログ全体。初期値は読み込み済みの直近分（それより前は選んだ時に読む）
+        min_date, max_date = log_first.date(), log_last.date()
+        default_start = min(max(min_date, log_start.date()), max_date)
+        log_date_range = st.date_input("期間選択", value=(default_start, max_date), min_value=min_date, max_value=max_date, key="log_date_filter")
     with col_log2:
-        # 1. すべての区分を取得し、除外したい項目を取り除く
-        all_types_raw = sorted(df_log["区分"].unique())
+        # 1. すべての区分を取得し、除外したい項目を取り除く（直近に無い区分も古い期間では選べるように、既知の区分も並べる）
+        known_types = set(MOVEMENT_SIGNS) | {"新規登録", "地名変更", "削除"}
+        all_types_raw = sorted(known_types | set(df_log["区分"].astype(str).unique()))
         exclude_list = ["基準変更", "編集"]
         # 除外リストにないものだけを候補にする（「すべて」という項目は今回不要になります）
         selectable_types = [t for t in all_types_raw if t not in exclude_list and str(t).strip() != ""]
@@ -321,30 +443,52 @@ if not df_log.empty:
         )
 
     # 2. データの絞り込み実行
-    df_log_filtered = df_log.copy()
-    
-    # 日付で絞り込み
-    if isinstance(log_date_range, tuple) and len(log_date_range) == 2:
-        start_date, end_date = log_date_range
-        df_log_filtered = df_log_filtered[
-            (df_log_filtered["日時"].dt.date >= start_date) & 
-            (df_log_filtered["日時"].dt.date <= end_date)
-        ]
-    
-    # 3. 複数選択された区分で絞り込み（選択がある場合のみ実行）
-    if selected_types:
-        df_log_filtered = df_log_filtered[df_log_filtered["区分"].isin(selected_types)]
+    with tracer.span("filter_log") as trace_record:
+        df_log_filtered = df_log
+
+        # 日付で絞り込み（datetime64 のまま比較する）。読み込み済みより前の期間なら、その期間だけ読み直す
+        if isinstance(log_date_range, tuple) and len(log_date_range) == 2:
+            start_date, end_date = log_date_range
+            if pd.Timestamp(start_date) < log_start:
+                df_log_filtered = get_log_range(path_log, pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1), sha_log)
+                if df_log_filtered.empty:
+                    df_log_filtered = df_log.iloc[:0]
+            df_log_filtered = df_log_filtered[
+                (df_log_filtered["日時"] >= pd.Timestamp(start_date)) & 
+                (df_log_filtered["日時"] < pd.Timestamp(end_date) + pd.Timedelta(days=1))
+            ]
+
+        # 3. 複数選択された区分で絞り込み（選択がある場合のみ実行）
+        if selected_types:
+            df_log_filtered = df_log_filtered[df_log_filtered["区分"].isin(selected_types)]
+        trace_record["rows"] = len(df_log_filtered)
 
    # 3. 履歴の表示
     disp_log_cols = ["日時", "商品名", "サイズ", "地名", "区分", "数量", "在庫数", "担当者"]
-    
-    st.dataframe(
-        df_log_filtered[disp_log_cols].sort_values("日時", ascending=False),
-        use_container_width=True,
-        hide_index=True,
-        column_config={
-            "日時": st.column_config.DatetimeColumn("日時", format="YYYY-MM-DD HH:mm"),
-            "数量": st.column_config.NumberColumn("数", format="%d"),
-            "在庫数": st.column_config.NumberColumn("現在庫", format="%d")
-        }
-    )
+    st.caption(f"{len(df_log_filtered):,} 件")
+    export_button(df_log_filtered[disp_log_cols], "stock_log.csv", "export_log")
+
+    df_log_page = paginate(df_log_filtered[disp_log_cols], "log_page", disp_log_cols, "日時")
+    with tracer.span("render_log", rows=len(df_log_page)):
+        st.dataframe(
+            df_log_page,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "日時": st.column_config.DatetimeColumn("日時", format="YYYY-MM-DD HH:mm"),
+                "数量": st.column_config.NumberColumn("数", format="%d"),
+                "在庫数": st.column_config.NumberColumn("現在庫", format="%d")
+            }
+        )
+
+# --- 計測結果（?debug=1 の時だけ表示。TRACE_LOG が有効なら JSON ログにも出す） ---
+write_trace = st.session_state.pop("write_trace", None)
+if SHOW_TRACE:
+    with st.sidebar.expander("⏱ 処理時間（この再実行）", expanded=True):
+        st.metric("合計", f"{tracer.total_ms:,.0f} ms")
+        st.dataframe(pd.DataFrame(tracer.spans), use_container_width=True, hide_index=True)
+    if write_trace:
+        with st.sidebar.expander("⏱ 処理時間（直前の書き込み）", expanded=True):
+            st.metric("合計", f"{write_trace[0]:,.0f} ms")
+            st.dataframe(pd.DataFrame(write_trace[1]), use_container_width=True, hide_index=True)
+tracer.emit()
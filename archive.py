@@ -0,0 +1,130 @@
+import argparse
+import json
+import sys
+from io import BytesIO
+
+import pandas as pd
+
+# --- 締めた月のログのアーカイブ ---
+# 入出庫ログのうち締めた月（今月より前）の行を、月ごとの Parquet ブロックにして
+# 「ログ名/archive/YYYY-MM.parquet」に置き、各ブロックの日時の min/max を index.json に書いておく。
+#   商品名・サイズ・地名・区分・担当者 … 辞書符号化（同じ文字列は1回だけ持つ）
+#   日時 … 日時順に並べて差分符号化（DELTA_BINARY_PACKED）
+#   全体 … zstd 圧縮。ブロック内も BLOCK_ROWS 行ごとの行グループに分かれ、行グループごとに min/max を持つ
+# 期間を指定した読み込みは index.json で期間外の月を取りに行かず、月の中でも期間外の行グループは展開しない。
+# CSV を base64 で取りに行くより、転送量も解析の手間も小さい。
+#   python -m archive                       # 今月(JST)より前の行をアーカイブ（拠点ごとのログも）
+#   python -m archive --before 2024-01-01   # この日より前の行だけ
+
+ARCHIVE_DIR = "archive"
+INDEX_NAME = "index.json"
+BLOCK_ROWS = 8192
+DICTIONARY_COLUMNS = ["商品名", "サイズ", "地名", "区分", "担当者"]
+MONTH_FORMAT = "%Y-%m"
+
+
+def block_name(month):
+    return f"{month}.parquet"
+
+
+def encode_block(df):
+    # 型付きログ（to_typed_log 済み、日時は欠けていない）を1ブロックの Parquet にする
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = df.sort_values("日時", kind="stable").reset_index(drop=True)
+    # ログの雑多な列（変動・詳細・出荷先など）は数値と空欄が混ざるので文字列にそろえる
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].astype(str)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    buf = BytesIO()
+    pq.write_table(
+        table, buf,
+        compression="zstd",
+        row_group_size=BLOCK_ROWS,
+        use_dictionary=[c for c in DICTIONARY_COLUMNS if c in df.columns],
+        column_encoding={"日時": "DELTA_BINARY_PACKED"},
+        write_statistics=True,
+    )
+    return buf.getvalue()
+
+
+def decode_block(data, start=None, end=None):
+    # start <= 日時 < end の行だけを返す。行グループの min/max で範囲外のグループは展開しない
+    import pyarrow.parquet as pq
+
+    filters = []
+    if start is not None:
+        filters.append(("日時", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("日時", "<", pd.Timestamp(end)))
+    return pq.read_table(BytesIO(data), filters=filters or None).to_pandas()
+
+
+def block_entry(month, df):
+    return {
+        "month": month,
+        "path": block_name(month),
+        "rows": int(len(df)),
+        "min": df["日時"].min().isoformat(),
+        "max": df["日時"].max().isoformat(),
+    }
+
+
+def encode_index(entries):
+    return json.dumps({"blocks": sorted(entries, key=lambda e: e["month"])}, ensure_ascii=False, indent=1).encode("utf-8")
+
+
+def decode_index(data):
+    return json.loads(data.decode("utf-8")).get("blocks", []) if data else []
+
+
+def overlapping(entries, start=None, end=None):
+    # 期間 [start, end) と重なるブロックだけ（古い月から順）
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    return [
+        e for e in entries
+        if (start is None or pd.Timestamp(e["max"]) >= start) and (end is None or pd.Timestamp(e["min"]) < end)
+    ]
+
+
+def split_closed(df, before):
+    # CSV のままのログを (締めた月ごとの {YYYY-MM: 行}, 残す行) に分ける。日時が読めない行は締められないので残す
+    ts = pd.to_datetime(df["日時"], errors="coerce")
+    closed = (ts < pd.Timestamp(before)).to_numpy(dtype=bool)
+    months = {m: part for m, part in df[closed].groupby(ts[closed].dt.strftime(MONTH_FORMAT), sort=True)}
+    return months, df[~closed]
+
+
+def main(argv=None):
+    from reservation_worker import FILE_PATH_LOG, REPO_NAME, load_config
+    from shards import ShardMap
+    from storage import create_storage
+
+    parser = argparse.ArgumentParser(description="締めた月の入出庫ログを圧縮ブロックへ移す")
+    parser.add_argument("--before", help="この日より前の行を移す（既定: 今月1日）")
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    shard_map = ShardMap(config)
+    log_paths = shard_map.paths(FILE_PATH_LOG) if shard_map.enabled else [FILE_PATH_LOG]
+    storage = create_storage(config, REPO_NAME, segmented_paths=log_paths)
+    # SQLite の時は先に GitHub へ書き戻してから、GitHub 側でアーカイブする
+    if getattr(storage, "remote", None) is not None:
+        storage.sync()
+        storage = storage.remote
+    if not hasattr(storage, "archive"):
+        print("アーカイブは GitHub の保存先でだけ使えます", file=sys.stderr)
+        return 1
+    failed = [path for path in log_paths if not storage.archive(path, before=args.before)]
+    if failed:
+        print(f"アーカイブに失敗しました: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    print(f"{len(log_paths)} 件のログをアーカイブしました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import itertools
+import threading
+import time
+
+from storage import GITHUB_API, _git_blob_sha
+
+# --- GitHub API のローカル代替 ---
+# GitHubStorage.session と差し替えて使う。storage.py が呼ぶ範囲だけを、メモリ上のリポジトリで再現する。
+#   contents/{path}  … GET（ファイル / ディレクトリ一覧 / raw、ETag → 304）, PUT, DELETE（sha が合わなければ 409）
+#   git/ref, git/commits, git/blobs, git/trees, git/refs … transact・archive の1コミット（fast-forward でなければ 422）
+# latency を渡すと、1リクエストごとに往復時間ぶん待つ（並列化の効果を見るため）。
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None, content=b""):
+        self.status_code = status_code
+        self._body = body
+        self.headers = headers or {}
+        self.content = content
+
+    def json(self):
+        return self._body
+
+
+class FakeGitHub:
+    def __init__(self, repo_name, files=None, branch="main", latency=0.0):
+        self.prefix = f"{GITHUB_API}/repos/{repo_name}"
+        self.branch = branch
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # ツリー = {パス: bytes}。コミットは (ツリー id, 親) で、ツリーはコミットごとに丸ごと持つ（ベンチ用なので十分）
+        self._trees = {"t0": dict(files or {})}
+        self._commits = {"c0": ("t0", None)}
+        self._blobs = {}
+        self.head = "c0"
+
+    # --- requests.Session と同じ呼び方 ---
+    def get(self, url, headers=None, params=None, **kwargs):
+        return self.request("GET", url, headers=headers, params=params)
+
+    def put(self, url, headers=None, json=None, **kwargs):
+        return self.request("PUT", url, headers=headers, json=json)
+
+    def delete(self, url, headers=None, json=None, **kwargs):
+        return self.request("DELETE", url, headers=headers, json=json)
+
+    def request(self, method, url, headers=None, params=None, json=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        path = url[len(self.prefix):].lstrip("/")
+        with self._lock:
+            self.requests += 1
+            if path.startswith("contents/"):
+                return self._contents(method, path[len("contents/"):], headers or {}, (params or {}).get("ref"), json)
+            return self._git(method, path, json)
+
+    # --- 中身 ---
+    def files(self, ref=None):
+        return self._trees[self._commits[ref or self.head][0]]
+
+    def _commit(self, files, parent):
+        tree, commit = f"t{next(self._ids)}", f"c{next(self._ids)}"
+        self._trees[tree] = files
+        self._commits[commit] = (tree, parent)
+        return commit
+
+    def _contents(self, method, path, headers, ref, body):
+        files = self.files(ref)
+        if method == "GET":
+            if path in files:
+                data = files[path]
+                sha = _git_blob_sha(data)
+                etag = f'"{sha}"'
+                if headers.get("If-None-Match") == etag:
+                    return FakeResponse(304, headers={"ETag": etag})
+                if headers.get("Accept") == "application/vnd.github.raw":
+                    return FakeResponse(200, headers={"ETag": etag}, content=data)
+                return FakeResponse(200, {"sha": sha, "content": base64.b64encode(data).decode()}, {"ETag": etag})
+            prefix = path.rstrip("/") + "/"
+            items = [
+                {"path": p, "sha": _git_blob_sha(d), "type": "file"}
+                for p, d in files.items() if p.startswith(prefix) and "/" not in p[len(prefix):]
+            ]
+            if not items:
+                return FakeResponse(404, {"message": "Not Found"})
+            etag = '"' + hashlib.sha1("".join(i["sha"] for i in items).encode()).hexdigest() + '"'
+            if headers.get("If-None-Match") == etag:
+                return FakeResponse(304, headers={"ETag": etag})
+            return FakeResponse(200, items, {"ETag": etag})
+
+        current = _git_blob_sha(files[path]) if path in files else None
+        if (body or {}).get("sha") != current:
+            return FakeResponse(409, {"message": "sha mismatch"})
+        files = dict(files)
+        if method == "PUT":
+            files[path] = base64.b64decode(body["content"])
+        elif method == "DELETE":
+            if current is None:
+                return FakeResponse(404, {"message": "Not Found"})
+            del files[path]
+        self.head = self._commit(files, self.head)
+        return FakeResponse(200 if current else 201, {"content": {"sha": _git_blob_sha(files.get(path, b""))}})
+
+    def _git(self, method, path, body):
+        if method == "GET" and path == "":
+            return FakeResponse(200, {"default_branch": self.branch})
+        if method == "GET" and path == f"git/ref/heads/{self.branch}":
+            return FakeResponse(200, {"object": {"sha": self.head}})
+        if method == "GET" and path.startswith("git/commits/"):
+            commit = self._commits.get(path[len("git/commits/"):])
+            return FakeResponse(200, {"tree": {"sha": commit[0]}}) if commit else FakeResponse(404)
+        if method == "POST" and path == "git/blobs":
+            data = base64.b64decode(body["content"]) if body.get("encoding") == "base64" else body["content"].encode("utf-8")
+            sha = _git_blob_sha(data)
+            self._blobs[sha] = data
+            return FakeResponse(201, {"sha": sha})
+        if method == "POST" and path == "git/trees":
+            files = dict(self._trees[body["base_tree"]])
+            for entry in body["tree"]:
+                if entry.get("content") is not None:
+                    files[entry["path"]] = entry["content"].encode("utf-8")
+                elif entry.get("sha") is not None:
+                    files[entry["path"]] = self._blobs[entry["sha"]]
+                else:
+                    files.pop(entry["path"], None)
+            tree = f"t{next(self._ids)}"
+            self._trees[tree] = files
+            return FakeResponse(201, {"sha": tree})
+        if method == "POST" and path == "git/commits":
+            commit = f"c{next(self._ids)}"
+            self._commits[commit] = (body["tree"], body["parents"][0])
+            return FakeResponse(201, {"sha": commit})
+        if method == "PATCH" and path == f"git/refs/heads/{self.branch}":
+            commit = self._commits.get(body["sha"])
+            if commit is None or (commit[1] != self.head and not body.get("force")):
+                return FakeResponse(422, {"message": "Update is not a fast forward"})
+            self.head = body["sha"]
+            return FakeResponse(200, {"object": {"sha": self.head}})
+        return FakeResponse(404, {"message": "Not Found"})
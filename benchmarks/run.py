@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from analytics import RollupCube, aging, rollup
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.synthetic import generate, to_csv_bytes
+from forecast import forecast, reorder_point
+from inventory import SKU_KEYS, EffectiveStock, apply_movements
+from ledger import Ledger
+from reservation_worker import FILE_PATH_LOG, FILE_PATH_RESERVATION, FILE_PATH_STOCK, REPO_NAME, run_due_reservations
+from storage import GitHubStorage, SQLiteStorage, fan_out
+
+# --- ベンチマーク ---
+# 合成データ（benchmarks.synthetic）を GitHub の代替（benchmarks.fake_github）か SQLite に置き、
+# 起動時の読み込み・ログ全体の読み込み・有効在庫・予約実行・一括コミット・分析画面の各タブの処理時間を測る。
+#   python -m benchmarks.run                        # 計測して baseline.json と比べる
+#   python -m benchmarks.run --save-baseline        # 今回の結果を baseline.json にする
+#   python -m benchmarks.run --log-rows 1000000 --latency 0.05
+# 各項目は repeat 回の最小値。baseline より tolerance を超えて遅い項目があれば終了コード 1。
+# baseline はデータの件数・保存先などの条件が同じ時だけ比べる。
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_TOLERANCE = 0.25
+BATCH_ROWS = 100
+INCREMENT_ROWS = 1000
+# 起動時に読むログの日数（app.py の LOG_WINDOW_DAYS と同じ値。app.py は import すると画面が動くので写している）
+LOG_WINDOW_DAYS = 90
+
+
+def make_storage(backend, files, latency, workdir):
+    # files: {パス: CSV の bytes}。呼ぶたびに新しい（キャッシュの空いた）ストレージを作る
+    if backend == "github":
+        storage = GitHubStorage(REPO_NAME, "benchmark", segmented_paths=[FILE_PATH_LOG], branch="main")
+        storage.session = FakeGitHub(REPO_NAME, files, latency=latency)
+        return storage
+    seed_dir = os.path.join(workdir, uuid.uuid4().hex)
+    os.makedirs(seed_dir)
+    for path, data in files.items():
+        with open(os.path.join(seed_dir, path), "wb") as f:
+            f.write(data)
+    return SQLiteStorage(os.path.join(seed_dir, "zaiko.db"), seed_dir=seed_dir)
+
+
+def load_all(storage):
+    # app.py の起動時と同じ読み方（3ファイルを並列に。ログは直近 LOG_WINDOW_DAYS 日分だけ）
+    log_start = pd.Timestamp.now().normalize() - pd.Timedelta(days=LOG_WINDOW_DAYS)
+    loaders = {
+        FILE_PATH_STOCK: storage.read,
+        FILE_PATH_LOG: lambda path: storage.read_range(path, start=log_start),
+        FILE_PATH_RESERVATION: storage.read,
+    }
+    return fan_out(lambda path: loaders[path](path)[0], loaders)
+
+
+def cases(args, files, workdir):
+    # (名前, 準備, 計測する処理)。準備の結果が処理に渡り、準備の時間は数えない
+    fresh = lambda: make_storage(args.backend, files, args.latency, workdir)
+    loaded = load_all(fresh())
+    df_stock, df_res = loaded[FILE_PATH_STOCK], loaded[FILE_PATH_RESERVATION]
+    # 分析画面・台帳はログ全体を使う
+    df_log = fresh().read_typed(FILE_PATH_LOG)[0]
+    now = pd.Timestamp.now()
+    today, stamp = now.date(), now.strftime("%Y-%m-%d %H:%M")
+    cube = RollupCube(cache_dir=None)
+    cube.refresh(df_log)
+    rng = np.random.default_rng(args.seed)
+
+    def warm():
+        storage = fresh()
+        load_all(storage)
+        return storage
+
+    def batch(storage):
+        moves = df_stock.iloc[rng.choice(len(df_stock), BATCH_ROWS, replace=False)][SKU_KEYS].assign(区分="出庫", 数量=1, 担当者="ベンチ")
+
+        def build(frames):
+            new_stock, new_logs = apply_movements(frames[FILE_PATH_STOCK], moves, stamp)
+            return {FILE_PATH_STOCK: ("write", new_stock), FILE_PATH_LOG: ("append", new_logs)}
+
+        return storage.transact([FILE_PATH_STOCK], build, "Benchmark Batch")
+
+    def incremental():
+        c = RollupCube(cache_dir=None)
+        c.refresh(df_log.iloc[:-INCREMENT_ROWS])
+        return c
+
+    return [
+        ("load_cold", fresh, load_all),
+        ("load_warm", warm, load_all),
+        ("load_log_full", fresh, lambda s: s.read_typed(FILE_PATH_LOG)),
+        ("effective_stock", None, lambda _: EffectiveStock(df_stock, df_res)),
+        ("reservation_exec", fresh, lambda s: run_due_reservations(s, today, stamp)),
+        ("batch_commit", fresh, batch),
+        ("analysis_cube_cold", None, lambda _: RollupCube(cache_dir=None).refresh(df_log)),
+        ("analysis_cube_incremental", incremental, lambda c: c.refresh(df_log)),
+        ("tab_summary", None, lambda _: (rollup(cube.daily, ["項目詳細"]), rollup(cube.daily, ["年", "月"]))),
+        ("tab_trend", None, lambda _: rollup(cube.daily, ["日付"])),
+        ("tab_dead_stock", None, lambda _: aging(df_stock, cube.last_moves, now)),
+        ("tab_safety_stock", None, lambda _: reorder_point(forecast(cube.daily, end=now))),
+        ("tab_history", None, lambda _: cube.rows[cube.rows["年"] == now.year]),
+        ("ledger_snapshot", None, lambda _: Ledger(df_log).snapshot_at(now)),
+    ]
+
+
+def measure(setup, func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        func(state)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare(results, baseline, tolerance):
+    # [(名前, 今回, baseline, 比, 判定)]
+    rows = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        ratio = seconds / base if base else None
+        verdict = "" if ratio is None else ("REGRESSION" if ratio > 1 + tolerance else "ok")
+        rows.append((name, seconds, base, ratio, verdict))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在庫管理・分析の処理時間を測り、baseline と比べる")
+    parser.add_argument("--skus", type=int, default=10000)
+    parser.add_argument("--log-rows", type=int, default=100000)
+    parser.add_argument("--res-rows", type=int, default=1000)
+    parser.add_argument("--backend", choices=["github", "sqlite"], default="github")
+    parser.add_argument("--latency", type=float, default=0.0, help="GitHub 代替の1往復あたりの待ち（秒）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="この名前の項目だけ測る")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    config = {k: getattr(args, k) for k in ("skus", "log_rows", "res_rows", "backend", "latency", "seed")}
+    stock, log, reservations = generate(args.skus, args.log_rows, args.res_rows, seed=args.seed)
+    files = {FILE_PATH_STOCK: to_csv_bytes(stock), FILE_PATH_LOG: to_csv_bytes(log), FILE_PATH_RESERVATION: to_csv_bytes(reservations)}
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, setup, func in cases(args, files, workdir):
+            if args.only and name not in args.only:
+                continue
+            results[name] = measure(setup, func, args.repeat)
+            print(f"{name:<28}{results[name]:>10.4f}s", file=sys.stderr)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("config") == config:
+            baseline = saved["results"]
+        else:
+            print("baseline と条件が違うので比較しません", file=sys.stderr)
+
+    rows = compare(results, baseline, args.tolerance)
+    print(f"{'項目':<28}{'今回':>10}{'baseline':>10}{'比':>8}")
+    for name, seconds, base, ratio, verdict in rows:
+        base_text = f"{base:.4f}" if base else "-"
+        ratio_text = f"{ratio:.2f}" if ratio else "-"
+        print(f"{name:<28}{seconds:>10.4f}{base_text:>10}{ratio_text:>8}  {verdict}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": {**baseline, **results}}, f, ensure_ascii=False, indent=2)
+        print(f"baseline を保存しました: {args.baseline}")
+        return 0
+    return 1 if any(verdict == "REGRESSION" for *_, verdict in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from inventory import LOG_COLUMNS
+
+# --- ベンチマーク用の合成データ ---
+# inventory_main.csv / stock_log_main.csv / reservations_main.csv と同じ列で、任意の件数のデータを作る。
+# マスタは app.py と同じ値（app.py は import すると画面が動くので写している）。
+#   python -m benchmarks.synthetic --skus 10000 --log-rows 1000000 --out /tmp/zaiko
+
+SIZES_MASTER = ["大", "中", "小", "4個入", " - "]
+VENDORS_MASTER = ["富士山", "東山観光", "モンテリア", "ベーカリー"]
+USERS = ["佐藤", "手塚", "檀原"]
+STOCK_COLUMNS = ["最終更新日", "商品名", "サイズ", "地名", "在庫数", "アラート基準", "取引先"]
+RESERVATION_COLUMNS = ["予約日", "商品名", "サイズ", "地名", "数量", "担当者"]
+# 実データの区分の比率に近づける（出庫が一番多い）
+LOG_KINDS = {"出庫": 0.55, "入庫": 0.25, "調整": 0.05, "出庫(予約実行)": 0.1, "編集": 0.03, "基準変更": 0.02}
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def generate(n_skus, n_log, n_res, days=730, seed=0, end=None):
+    # (在庫表, ログ, 予約表) を返す。ログは日時順、予約は end の翌日から30日以内
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or pd.Timestamp.now()).floor("min")
+    n_items = max(1, n_skus // 10)
+    n_locs = max(1, n_skus // (n_items * len(SIZES_MASTER)) + 1)
+    # (商品名, サイズ, 地名) が重ならないように番号から組を作る
+    codes = rng.choice(n_items * len(SIZES_MASTER) * n_locs, size=n_skus, replace=False)
+    items = np.array([f"商品{i:05d}" for i in range(n_items)], dtype=object)
+    locs = np.array([f"地点{i:04d}" for i in range(n_locs)], dtype=object)
+    stock = pd.DataFrame({
+        "最終更新日": end.strftime(TIME_FORMAT),
+        "商品名": items[codes // (len(SIZES_MASTER) * n_locs)],
+        "サイズ": np.array(SIZES_MASTER, dtype=object)[codes // n_locs % len(SIZES_MASTER)],
+        "地名": locs[codes % n_locs],
+        "在庫数": rng.integers(0, 500, n_skus),
+        "アラート基準": rng.integers(0, 30, n_skus),
+        "取引先": rng.choice(VENDORS_MASTER, n_skus),
+    })[STOCK_COLUMNS]
+
+    # ログは一部の SKU に偏らせる（売れ筋とそうでないものの差を出す）
+    weights = rng.pareto(1.2, n_skus) + 1
+    sku = rng.choice(n_skus, size=n_log, p=weights / weights.sum())
+    offsets = np.sort(rng.integers(0, days * 24 * 60, n_log))
+    kinds = rng.choice(list(LOG_KINDS), size=n_log, p=list(LOG_KINDS.values()))
+    qty = rng.integers(1, 20, n_log)
+    qty = np.where(np.isin(kinds, ["編集", "基準変更"]), 0, qty)
+    log = pd.DataFrame({
+        "日時": (end - pd.Timedelta(days=days) + pd.to_timedelta(offsets, unit="min")).strftime(TIME_FORMAT),
+        "商品名": stock["商品名"].to_numpy()[sku],
+        "サイズ": stock["サイズ"].to_numpy()[sku],
+        "地名": stock["地名"].to_numpy()[sku],
+        "区分": kinds,
+        "数量": qty,
+        "在庫数": "",
+        "担当者": rng.choice(USERS, n_log),
+    })[LOG_COLUMNS]
+
+    res_sku = rng.choice(n_skus, size=n_res)
+    reservations = pd.DataFrame({
+        "予約日": (end.normalize() + pd.to_timedelta(rng.integers(-1, 30, n_res), unit="D")).strftime("%Y-%m-%d"),
+        "商品名": stock["商品名"].to_numpy()[res_sku],
+        "サイズ": stock["サイズ"].to_numpy()[res_sku],
+        "地名": stock["地名"].to_numpy()[res_sku],
+        "数量": rng.integers(1, 10, n_res),
+        "担当者": rng.choice(USERS, n_res),
+    })[RESERVATION_COLUMNS]
+    return stock, log, reservations
+
+
+def to_csv_bytes(df):
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用の在庫・ログ・予約 CSV を作る")
+    parser.add_argument("--skus", type=int, default=10000)
+    parser.add_argument("--log-rows", type=int, default=100000)
+    parser.add_argument("--res-rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=".")
+    args = parser.parse_args(argv)
+
+    stock, log, reservations = generate(args.skus, args.log_rows, args.res_rows, seed=args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    for name, df in (("inventory_main.csv", stock), ("stock_log_main.csv", log), ("reservations_main.csv", reservations)):
+        df.to_csv(os.path.join(args.out, name), index=False)
+    print(f"{args.out}: 在庫 {len(stock):,} 行 / ログ {len(log):,} 行 / 予約 {len(reservations):,} 行")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from inventory import SKU_KEYS, apply_movements
+
+# --- 入出庫の一括取込 / 書き出し ---
+# CSV / Excel の1行 = 1件の入出庫。ファイル全体を一度に読まず CHUNK_ROWS 行ずつ読み、ブロックごとに列単位で検証する。
+# 取込の列:
+#   区分（入庫 / 出庫 / 予約出庫 / 調整）, 商品名, サイズ, 地名, 数量 … 必須
+#   予約日（予約出庫の時は必須）, 取引先, 担当者（空欄なら画面で選んだ担当者）… 任意
+# 行番号はファイル上の行（見出しが1行目）。エラーのある行は取り込まず、行ごとの理由を返す。
+
+IMPORT_KINDS = ["入庫", "出庫", "予約出庫", "調整"]
+REQUIRED_COLUMNS = ["区分"] + SKU_KEYS + ["数量"]
+OPTIONAL_COLUMNS = ["予約日", "取引先", "担当者"]
+ERROR_COLUMNS = ["行", "内容"]
+MOVE_COLUMNS = ["区分"] + SKU_KEYS + ["数量", "予約日", "担当者"]
+CHUNK_ROWS = 5000
+EXCEL_SUFFIXES = (".xlsx", ".xlsm")
+
+
+def iter_chunks(file, name, chunksize=CHUNK_ROWS):
+    # 全列を文字列にした DataFrame を chunksize 行ずつ返す（空欄は ""）
+    if name.lower().endswith(EXCEL_SUFFIXES):
+        from openpyxl import load_workbook
+
+        # read_only だとシートを丸ごと展開せず、1行ずつ読む
+        rows = load_workbook(file, read_only=True, data_only=True).active.iter_rows(values_only=True)
+        header = ["" if h is None else str(h).strip() for h in next(rows, ())]
+        while True:
+            block = list(islice(rows, chunksize))
+            if not block:
+                return
+            yield pd.DataFrame(block, columns=header, dtype=object).map(lambda v: "" if v is None else str(v))
+    else:
+        for chunk in pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunksize, encoding="utf-8-sig"):
+            yield chunk.rename(columns=lambda c: str(c).strip())
+
+
+def validate_chunk(chunk, first_line, skus, sizes, vendors, users, default_user):
+    # (取り込める行, エラー行) を返す。1行に複数の問題があれば「; 」でつなぐ
+    chunk = chunk.reindex(columns=REQUIRED_COLUMNS + OPTIONAL_COLUMNS, fill_value="")
+    kind = chunk["区分"].str.strip()
+    qty = pd.to_numeric(chunk["数量"], errors="coerce")
+    bad_qty = qty.isna() | (qty % 1 != 0)
+    res_date = pd.to_datetime(chunk["予約日"], errors="coerce", format="mixed")
+    vendor, user = chunk["取引先"].str.strip(), chunk["担当者"].str.strip()
+    problems = [
+        (~kind.isin(IMPORT_KINDS), "区分が不正です"),
+        (~chunk["サイズ"].isin(sizes), "サイズがマスタにありません"),
+        (~pd.MultiIndex.from_frame(chunk[SKU_KEYS]).isin(skus), "在庫表に無い商品です"),
+        (bad_qty, "数量が整数ではありません"),
+        (~bad_qty & (qty == 0), "数量が0です"),
+        (~bad_qty & (qty < 0) & (kind != "調整"), "調整以外で数量がマイナスです"),
+        ((kind == "予約出庫") & res_date.isna(), "予約日が日付ではありません"),
+        ((vendor != "") & ~vendor.isin(vendors), "取引先がマスタにありません"),
+        ((user != "") & ~user.isin(users), "担当者が登録されていません"),
+    ]
+    messages = pd.Series("", index=chunk.index)
+    for mask, text in problems:
+        messages = messages.mask(np.asarray(mask), messages + text + "; ")
+    messages = messages.str.removesuffix("; ")
+    bad = (messages != "").to_numpy()
+
+    lines = first_line + pd.RangeIndex(len(chunk))
+    errors = pd.DataFrame({"行": lines[bad], "内容": messages[bad].to_numpy()})
+    ok = ~bad
+    moves = pd.DataFrame({
+        "区分": kind[ok].to_numpy(),
+        **{k: chunk.loc[ok, k].to_numpy() for k in SKU_KEYS},
+        "数量": qty[ok].to_numpy(dtype="int64"),
+        "予約日": res_date[ok].dt.strftime("%Y-%m-%d").where(kind[ok] == "予約出庫", "").to_numpy(),
+        "担当者": user[ok].replace("", default_user).to_numpy(),
+    })
+    return moves, errors
+
+
+def read_movements(file, name, sku_index, sizes, vendors, users, default_user, chunksize=CHUNK_ROWS):
+    # ファイル全体を検証して (取り込める行, エラー行) を返す
+    skus = pd.MultiIndex.from_tuples([tuple(str(v) for v in k) for k in sku_index], names=SKU_KEYS)
+    moves, errors, line = [], [], 2
+    try:
+        for chunk in iter_chunks(file, name, chunksize):
+            missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+            if missing:
+                return pd.DataFrame(columns=MOVE_COLUMNS), pd.DataFrame([{"行": 1, "内容": f"列がありません: {', '.join(missing)}"}])
+            ok, bad = validate_chunk(chunk, line, skus, sizes, vendors, users, default_user)
+            moves.append(ok)
+            errors.append(bad)
+            line += len(chunk)
+    except (ValueError, UnicodeDecodeError) as e:
+        errors.append(pd.DataFrame([{"行": line, "内容": f"読み込めません: {e}"}]))
+    moves = pd.concat(moves, ignore_index=True) if moves else pd.DataFrame(columns=MOVE_COLUMNS)
+    errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=ERROR_COLUMNS)
+    return moves, errors
+
+
+def apply_import(df_stock, moves, now):
+    # 検証済みの行を在庫表に当てて (在庫表, ログ行, 予約行) を返す（app.apply_batch と同じ形）
+    is_res = (moves["区分"] == "予約出庫").to_numpy()
+    df_stock, df_logs = apply_movements(df_stock, moves.loc[~is_res, SKU_KEYS + ["区分", "数量", "担当者"]], now)
+    df_res = moves.loc[is_res, ["予約日"] + SKU_KEYS + ["数量", "担当者"]].reset_index(drop=True)
+    return df_stock, df_logs, df_res
+
+
+def iter_csv(df, chunksize=CHUNK_ROWS):
+    # CSV を chunksize 行ずつエンコードして返す（先頭だけ BOM と見出し付き。Excel でそのまま開ける）
+    for start in range(0, max(len(df), 1), chunksize):
+        text = df.iloc[start:start + chunksize].to_csv(index=False, header=start == 0)
+        yield text.encode("utf-8-sig" if start == 0 else "utf-8")
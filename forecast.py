@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from analytics import ITEM_KEYS
+
+# --- 需要予測と発注点 ---
+# 出庫ロールアップ（analytics の日次表）から SKU × 日 の需要行列を作り、全 SKU を配列演算でまとめて予測する。
+#   日次予測 … 単純指数平滑（SES）。出庫の無い日は 0 として扱うので、最近動いていない商品ほど小さくなる
+#   移動平均 / 日次標準偏差 … 直近 WINDOW_DAYS 日
+#   発注点 … リードタイム中の予測需要 + 安全在庫（z × σ × √リードタイム）
+# 以前の「1件あたり数量の 平均 + 2σ」は出庫の間隔とリードタイムを見ていなかった。
+
+LEAD_TIME_DAYS = 7
+WINDOW_DAYS = 28
+SES_ALPHA = 0.3
+# 欠品させない確率 95% 相当
+SERVICE_Z = 1.65
+STATS_COLUMNS = ITEM_KEYS + ["項目詳細", "日次予測", "移動平均", "日次標準偏差"]
+
+
+def demand_matrix(daily, end=None):
+    # (SKU の表, SKU × 日 の数量行列, 日付) を返す。end（既定: 最終出庫日）までの出庫の無い日も 0 で埋める
+    if daily.empty:
+        return pd.DataFrame(columns=ITEM_KEYS), np.zeros((0, 0)), pd.DatetimeIndex([])
+    days = pd.to_datetime(daily["日付"]).dt.normalize()
+    end = days.max() if end is None else pd.Timestamp(end).normalize()
+    keep = (days <= end).to_numpy()
+    days, daily = days[keep], daily[keep]
+    if daily.empty:
+        return pd.DataFrame(columns=ITEM_KEYS), np.zeros((0, 0)), pd.DatetimeIndex([])
+    dates = pd.date_range(days.min(), end, freq="D")
+    groups = daily[ITEM_KEYS].astype(str).groupby(ITEM_KEYS, sort=True)
+    sku_codes = groups.ngroup().to_numpy()
+    skus = groups.size().index
+    day_codes = ((days - dates[0]).dt.days).to_numpy()
+    matrix = np.zeros((len(skus), len(dates)))
+    np.add.at(matrix, (sku_codes, day_codes), daily["数量"].to_numpy(dtype="float64"))
+    return skus.to_frame(index=False), matrix, dates
+
+
+def ses_weights(n_days, alpha=SES_ALPHA):
+    # level_0 = x_0, level_t = α x_t + (1-α) level_{t-1} を展開した重み（古い日 → 新しい日）。
+    # 行列 @ 重み の1回で全 SKU の最終 level が出る
+    age = np.arange(n_days - 1, -1, -1)
+    weights = alpha * (1 - alpha) ** age
+    if n_days:
+        weights[0] = (1 - alpha) ** (n_days - 1)
+    return weights
+
+
+def forecast(daily, end=None, window=WINDOW_DAYS, alpha=SES_ALPHA):
+    # 全 SKU の 日次予測・移動平均・日次標準偏差
+    skus, matrix, _ = demand_matrix(daily, end)
+    if not len(skus):
+        return pd.DataFrame(columns=STATS_COLUMNS)
+    recent = matrix[:, -window:]
+    stats = skus.assign(
+        項目詳細=skus[ITEM_KEYS[0]].str.cat([skus[k] for k in ITEM_KEYS[1:]], sep=" | "),
+        日次予測=matrix @ ses_weights(matrix.shape[1], alpha),
+        移動平均=recent.mean(axis=1),
+        日次標準偏差=recent.std(axis=1, ddof=1) if recent.shape[1] > 1 else 0.0,
+    )
+    return stats[STATS_COLUMNS]
+
+
+def reorder_point(stats, lead_time=LEAD_TIME_DAYS, z=SERVICE_Z):
+    # 発注点（切り上げの整数）。在庫がこれを下回ったら発注する = アラート基準の推奨値
+    rop = stats["日次予測"] * lead_time + z * stats["日次標準偏差"] * np.sqrt(lead_time)
+    return np.ceil(rop.to_numpy(dtype="float64")).astype("int64")
+
+
+def suggested_alerts(daily, end=None, lead_time=LEAD_TIME_DAYS, z=SERVICE_Z):
+    # (商品名, サイズ, 地名) → 推奨アラート基準 の Series。一度も出庫の無い SKU は含まない
+    stats = forecast(daily, end)
+    index = pd.MultiIndex.from_frame(stats[ITEM_KEYS]) if len(stats) else pd.MultiIndex.from_tuples([], names=ITEM_KEYS)
+    return pd.Series(reorder_point(stats, lead_time, z) if len(stats) else [], index=index, dtype="int64", name="推奨基準")
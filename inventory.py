@@ -0,0 +1,106 @@
+import pandas as pd
+
+# --- 在庫データの操作 ---
+# 在庫表(inventory_main.csv)は (商品名, サイズ, 地名) の組で1行が決まる。
+# 行を探すたびに3列の比較マスクを作ると「処理行数 × SKU数」になるので、dict の索引を引く。
+
+SKU_KEYS = ["商品名", "サイズ", "地名"]
+
+
+def sku_of(row):
+    return tuple(row[k] for k in SKU_KEYS)
+
+
+def build_sku_index(df_stock):
+    # {(商品名, サイズ, 地名): 行ラベル}。同じ組が複数あれば先頭の行（従来の mask の index[0] と同じ）
+    index = {}
+    if df_stock.empty:
+        return index
+    for label, key in zip(df_stock.index, zip(*(df_stock[k] for k in SKU_KEYS))):
+        index.setdefault(key, label)
+    return index
+
+
+def rekey_sku(index, old_key, new_key):
+    # 地名変更などで組が変わった行を付け替える。変更先に別の行があればそちらを優先する
+    if old_key == new_key or old_key not in index:
+        return
+    label = index.pop(old_key)
+    index.setdefault(new_key, label)
+
+
+# --- 入出庫の一括反映 ---
+# 在庫数に対する区分ごとの向き。予約出庫は予約表に入るだけで在庫は動かない
+MOVEMENT_SIGNS = {"入庫": 1, "調整": 1, "出庫": -1, "出庫(予約実行)": -1}
+LOG_COLUMNS = ["日時", "商品名", "サイズ", "地名", "区分", "数量", "在庫数", "担当者"]
+# 地名変更の行には変更前の地名をこの列に残す（台帳で元の地名の残高を 0 にするため）。
+# 出荷先を書く「詳細・出荷先」とは混ぜず、専用の列にする
+MOVED_FROM_COLUMN = "変更前地名"
+
+
+def apply_movements(df_stock, df_moves, now):
+    # df_moves は 商品名/サイズ/地名/区分/数量/担当者 の1件1行。
+    # SKU ごとに差分を合計して在庫数へ一度に足し込み、(更新後の在庫表, ログ行) を返す。
+    # ログの在庫数は SKU 内の累積和なので、1件ずつ処理した時と同じ値になる。
+    # 在庫表に無い SKU の移動は従来どおり無視する。
+    if df_moves.empty or df_stock.empty:
+        return df_stock, pd.DataFrame(columns=LOG_COLUMNS)
+    moves = df_moves.reset_index(drop=True)
+    moves["_delta"] = moves["数量"] * moves["区分"].map(MOVEMENT_SIGNS).fillna(0).astype(int)
+    # 同じ SKU が複数行あれば先頭の行だけを対象にする（build_sku_index と同じ）
+    first = ~df_stock.duplicated(SKU_KEYS)
+    base = df_stock.loc[first, SKU_KEYS + ["在庫数"]].rename(columns={"在庫数": "_base"})
+    moves = moves.merge(base, on=SKU_KEYS, how="inner")
+    if moves.empty:
+        return df_stock, pd.DataFrame(columns=LOG_COLUMNS)
+    moves["在庫数"] = moves["_base"] + moves.groupby(SKU_KEYS, sort=False)["_delta"].cumsum()
+    moves["日時"] = now
+
+    totals = moves.groupby(SKU_KEYS, sort=False)["_delta"].sum()
+    keys = pd.MultiIndex.from_frame(df_stock[SKU_KEYS])
+    touched = keys.isin(totals.index) & first.to_numpy()
+    df_stock = df_stock.copy()
+    df_stock.loc[touched, "在庫数"] = df_stock.loc[touched, "在庫数"] + totals.reindex(keys[touched]).to_numpy()
+    df_stock.loc[touched, "最終更新日"] = now
+    return df_stock, moves[LOG_COLUMNS]
+
+
+
+# --- 有効在庫（在庫数 - 予約計）---
+class EffectiveStock:
+    # SKU を索引にした 在庫数 / 予約計 / 有効在庫 / アラート の表。
+    # 在庫表・予約表のどちらかだけが変わった時は、その列だけを差し替える（もう片方の集計はやり直さない）
+    COLUMNS = ["在庫数", "アラート基準", "予約計", "有効在庫", "アラート"]
+
+    def __init__(self, df_stock, df_res):
+        self.table = pd.DataFrame(columns=self.COLUMNS, index=pd.MultiIndex.from_tuples([], names=SKU_KEYS))
+        self.set_stock(df_stock)
+        self.set_reservations(df_res)
+
+    def set_stock(self, df_stock):
+        if df_stock.empty:
+            self.table = self.table.iloc[0:0]
+            return
+        stock = df_stock.drop_duplicates(SKU_KEYS).set_index(SKU_KEYS)[["在庫数", "アラート基準"]]
+        reserved = self.table["予約計"].reindex(stock.index, fill_value=0) if not self.table.empty else 0
+        self.table = stock.assign(予約計=reserved)
+        self._refresh()
+
+    def set_reservations(self, df_res):
+        if self.table.empty:
+            return
+        if df_res.empty:
+            reserved = pd.Series(0, index=self.table.index)
+        else:
+            reserved = df_res.groupby(SKU_KEYS)["数量"].sum().reindex(self.table.index, fill_value=0)
+        self.table["予約計"] = reserved
+        self._refresh()
+
+    def _refresh(self):
+        self.table["有効在庫"] = self.table["在庫数"] - self.table["予約計"]
+        self.table["アラート"] = self.table["有効在庫"] < self.table["アラート基準"]
+
+    def join(self, df, columns):
+        # df の (商品名, サイズ, 地名) で表の列を付け足す。見つからない SKU は 0 / アラートなし
+        out = df.join(self.table[columns], on=SKU_KEYS)
+        return out.fillna({c: (False if c == "アラート" else 0) for c in columns})
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+from inventory import SKU_KEYS, MOVEMENT_SIGNS, MOVED_FROM_COLUMN
+
+# --- 在庫台帳（ログの再生） ---
+# 入出庫ログを頭から再生して SKU ごとの残高の推移を作り、
+#   ・ある時点の在庫（1 SKU / 全 SKU）
+#   ・期間内の残高の推移
+#   ・ログに記録された在庫数 / inventory_main.csv の在庫数とのずれ
+# を答える。1 SKU の問い合わせは時刻の二分探索、全 SKU の時点在庫は SKU ごとの「when 以前の記録数」を1回数えるだけで済む。
+#
+# 区分ごとの扱い:
+#   入庫 / 出庫 / 調整 / 出庫(予約実行) … 数量を差分として足す（MOVEMENT_SIGNS）
+#   新規登録 … 数量を初期在庫として置く / 地名変更 … 記録された在庫数を置く / 削除 … 0 にする
+#   それ以外（編集・基準変更など）… 残高は変わらない
+# 地名変更は変更前の地名（MOVED_FROM_COLUMN）も分かれば、同じ時刻に元の SKU の残高を 0 にする行を足す。
+# 新規登録より前から記録のある SKU は 0 からではなく、最初に記録された在庫数から数える。
+
+RESET_KINDS = {"新規登録": "数量", "地名変更": "在庫数", "削除": None}
+
+
+def replay(df_log):
+    # ログを (SKU, 日時, 元の順) に並べ、各行の後の残高「再生在庫」を付けて返す
+    df = df_log[df_log["日時"].notna()].copy()
+    df["_moved_out"] = False
+    if MOVED_FROM_COLUMN in df:
+        moved_from = df[MOVED_FROM_COLUMN].astype(str).str.strip()
+        moved = (df["区分"].astype(str) == "地名変更") & ~moved_from.isin(["", "nan", "<NA>"])
+        if moved.any():
+            out = df[moved].assign(地名=moved_from[moved], 数量=0, _moved_out=True)
+            out["在庫数"] = pd.NA
+            df = pd.concat([df, out], ignore_index=True)
+    df["_order"] = np.arange(len(df))
+    df = df.sort_values(SKU_KEYS + ["日時", "_order"], kind="stable").reset_index(drop=True)
+    kind = df["区分"].astype(str)
+    qty = pd.to_numeric(df["数量"], errors="coerce").fillna(0).to_numpy(dtype="int64")
+    recorded = pd.to_numeric(df["在庫数"], errors="coerce")
+
+    delta = qty * kind.map(MOVEMENT_SIGNS).fillna(0).to_numpy(dtype="int64")
+    reset = np.zeros(len(df), dtype=bool)
+    reset_value = np.zeros(len(df), dtype="int64")
+    for k, col in RESET_KINDS.items():
+        rows = (kind == k).to_numpy()
+        if col == "在庫数":
+            # 在庫数が空欄の行は置き直しようがないので、残高を変えない行として扱う
+            rows = rows & recorded.notna().to_numpy()
+            reset_value[rows] = recorded[rows].to_numpy(dtype="int64")
+        elif col == "数量":
+            reset_value[rows] = qty[rows]
+        reset |= rows
+    # 地名変更で出ていった元の SKU は 0
+    moved_out = df["_moved_out"].to_numpy(dtype=bool)
+    reset_value[moved_out] = 0
+    reset |= moved_out
+
+    sku_change = np.ones(len(df), dtype=bool)
+    if len(df) > 1:
+        same = np.ones(len(df) - 1, dtype=bool)
+        for k in SKU_KEYS:
+            col = df[k].astype(str).to_numpy()
+            same &= col[1:] == col[:-1]
+        sku_change[1:] = ~same
+    # 置き直しの行より前に在庫数の記録がある SKU は、最初に記録された在庫数をその行の後の残高にする
+    sku_id = np.cumsum(sku_change)
+    before_reset = pd.Series(reset).groupby(sku_id).cumsum().to_numpy() == 0
+    seed = recorded.notna().to_numpy() & before_reset
+    seed &= pd.Series(seed).groupby(sku_id).cumsum().to_numpy() == 1
+    reset_value[seed] = recorded[seed].to_numpy(dtype="int64")
+    reset |= seed
+    delta[reset] = 0
+
+    # SKU が変わる所と置き直しの行で区切り、区切りごとに「置いた値 + 差分の累積」を取る
+    group = np.cumsum(sku_change | reset)
+    df["再生在庫"] = pd.Series(delta).groupby(group).cumsum().to_numpy() + pd.Series(reset_value).groupby(group).transform("first").to_numpy()
+    df["_sku_start"] = sku_change
+    return df.drop(columns=["_order", "_moved_out"])
+
+
+def _label(sku):
+    return " | ".join(str(v) for v in sku)
+
+
+class Ledger:
+    def __init__(self, df_log):
+        self.events = replay(df_log)
+        ev = self.events
+        labels = ev[SKU_KEYS[0]].astype(str)
+        for k in SKU_KEYS[1:]:
+            labels = labels + " | " + ev[k].astype(str)
+        # SKU ごとの (時刻配列, 残高配列, events 内の開始位置)。events は SKU 順なので連続区間を切り出すだけ
+        starts = np.flatnonzero(ev["_sku_start"].to_numpy())
+        ends = np.append(starts[1:], len(ev))
+        ts = ev["日時"].to_numpy(dtype="datetime64[ns]")
+        bal = ev["再生在庫"].to_numpy()
+        self._by_sku = {labels.iat[s]: (ts[s:e], bal[s:e], s) for s, e in zip(starts, ends)}
+        # SKU ごとの (商品名, サイズ, 地名)。開始行をまとめて取り出す（1 SKU ずつ .loc すると SKU 数に比例して遅い）
+        self._sku_rows = ev.loc[starts, SKU_KEYS].astype(str).reset_index(drop=True)
+        self._skus = dict(zip(labels.iloc[starts], self._sku_rows.itertuples(index=False, name=None)))
+        self._starts, self._ts, self._bal = starts, ts, bal
+
+    def stock_at(self, sku, when):
+        # when 時点（その時刻の記録を含む）の在庫。それより前に記録が無ければ 0
+        entry = self._by_sku.get(_label(sku))
+        if entry is None:
+            return 0
+        ts, bal, _ = entry
+        i = np.searchsorted(ts, np.datetime64(pd.Timestamp(when), "ns"), side="right")
+        return int(bal[i - 1]) if i else 0
+
+    def history(self, sku, start, end):
+        # start <= 日時 <= end の記録を、再生在庫つきで返す
+        entry = self._by_sku.get(_label(sku))
+        if entry is None:
+            return self.events.iloc[0:0]
+        ts, _, offset = entry
+        lo = np.searchsorted(ts, np.datetime64(pd.Timestamp(start), "ns"), side="left")
+        hi = np.searchsorted(ts, np.datetime64(pd.Timestamp(end), "ns"), side="right")
+        return self.events.iloc[offset + lo:offset + hi]
+
+    def snapshot_at(self, when):
+        # 全 SKU の when 時点在庫（when より前に記録の無い SKU は出さない）。
+        # events は SKU ごとに時刻順なので、SKU ごとの「when 以前の記録数」がそのまま最後の記録の位置になる
+        if not len(self._starts):
+            return pd.DataFrame(columns=SKU_KEYS + ["在庫数"])
+        when = np.datetime64(pd.Timestamp(when), "ns")
+        n = np.add.reduceat((self._ts <= when).astype("int64"), self._starts)
+        seen = n > 0
+        snap = self._sku_rows[seen].reset_index(drop=True)
+        snap["在庫数"] = self._bal[(self._starts + n - 1)[seen]].astype("int64")
+        return snap
+
+    def log_drift(self):
+        # ログに書かれた在庫数と再生在庫が食い違う行
+        recorded = pd.to_numeric(self.events["在庫数"], errors="coerce")
+        return self.events[recorded.notna() & (recorded != self.events["再生在庫"])]
+
+    def stock_drift(self, df_stock):
+        # inventory_main.csv の在庫数と、ログを最後まで再生した残高の比較（差があるものだけ）。
+        # 在庫表に無いのにログ上は残高が残っている SKU も、在庫数 0 として出す
+        stock = df_stock.drop_duplicates(SKU_KEYS).copy()
+        labels = [_label(sku) for sku in zip(*(stock[c] for c in SKU_KEYS))]
+        stock["再生在庫"] = [int(self._by_sku[label][1][-1]) if label in self._by_sku else 0 for label in labels]
+        in_stock = set(labels)
+        missing = [
+            (*self._skus[label], 0, int(entry[1][-1]))
+            for label, entry in self._by_sku.items() if label not in in_stock and entry[1][-1] != 0
+        ]
+        if missing:
+            stock = pd.concat([stock, pd.DataFrame(missing, columns=SKU_KEYS + ["在庫数", "再生在庫"])], ignore_index=True)
+        stock["差異"] = pd.to_numeric(stock["在庫数"], errors="coerce").fillna(0) - stock["再生在庫"]
+        return stock.loc[stock["差異"] != 0, SKU_KEYS + ["在庫数", "再生在庫", "差異"]]
@@ -0,0 +1,118 @@
+import argparse
+import datetime as dt
+import os
+import sys
+
+import pandas as pd
+
+from storage import create_storage
+from inventory import SKU_KEYS, apply_movements
+from shards import ShardMap
+from tracing import Tracer, configure_logging
+
+# --- 出庫予約の実行ワーカー ---
+# 予約日が来た予約を在庫・ログに反映して予約表から消す。画面の読み込みとは切り離して cron などから1日1回動かす。
+#   python -m reservation_worker            # 今日(JST)までの予約を実行
+#   python -m reservation_worker --force    # 今日すでに実行済みでも、もう一度実行
+# 設定は環境変数、無ければ .streamlit/secrets.toml から読む（キーは app.py の st.secrets と同じ）。
+# 拠点ごとにファイルを分けている時（secrets の SHARDS）は、拠点ごとに別のコミットで実行する。
+
+REPO_NAME = "iplan381/zaiko-kanri"
+FILE_PATH_STOCK = "inventory_main.csv"
+FILE_PATH_LOG = "stock_log_main.csv"
+FILE_PATH_RESERVATION = "reservations_main.csv"
+# 実行済みの印。予約の反映と同じコミットで1行追記するので、反映だけされて印が無い状態にはならない
+FILE_PATH_RUNS = "reservation_runs.csv"
+CONFIG_KEYS = ["GITHUB_TOKEN", "GITHUB_BRANCH", "STORAGE_BACKEND", "SQLITE_PATH", "GITHUB_SYNC_INTERVAL", "TRACE_LOG"]
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+
+JST = dt.timezone(dt.timedelta(hours=9))
+
+
+def load_config():
+    config = {}
+    if os.path.exists(SECRETS_PATH):
+        import tomllib
+
+        with open(SECRETS_PATH, "rb") as f:
+            config.update(tomllib.load(f))
+    config.update({k: os.environ[k] for k in CONFIG_KEYS if k in os.environ})
+    return config
+
+
+def already_ran(storage, today, paths=None):
+    df_runs, _ = storage.read((paths or {}).get(FILE_PATH_RUNS, FILE_PATH_RUNS))
+    return not df_runs.empty and str(today) in set(df_runs["実行日"].astype(str))
+
+
+def run_due_reservations(storage, today, now, paths=None):
+    # 予約日 <= today の予約を実行し、実行した件数を返す（失敗時は None）。
+    # 対象は transact の中で最新の予約表から選ぶので、複数台が同時に動いても二重に引かれない。
+    # paths は {ファイル名: 拠点のファイル}（ShardMap.path）。無ければ従来の1ファイル
+    path = {f: f for f in (FILE_PATH_STOCK, FILE_PATH_LOG, FILE_PATH_RESERVATION, FILE_PATH_RUNS)}
+    path.update(paths or {})
+    executed = []
+
+    def build(frames):
+        executed.clear()
+        df_res = frames[path[FILE_PATH_RESERVATION]]
+        if df_res.empty:
+            return {}
+        due = pd.to_datetime(df_res["予約日"]).dt.date <= today
+        if not due.any():
+            return {}
+        moves = df_res[due][SKU_KEYS + ["数量", "担当者"]].assign(区分="出庫(予約実行)")
+        df_new_stock, df_new_logs = apply_movements(frames[path[FILE_PATH_STOCK]], moves, now)
+        executed.append(len(df_new_logs))
+        run = pd.DataFrame([{"実行日": str(today), "実行日時": now, "件数": len(df_new_logs)}])
+        changes = {path[FILE_PATH_RESERVATION]: ("write", df_res[~due]), path[FILE_PATH_RUNS]: ("append", run)}
+        if not df_new_logs.empty:
+            changes[path[FILE_PATH_STOCK]] = ("write", df_new_stock)
+            changes[path[FILE_PATH_LOG]] = ("append", df_new_logs)
+        return changes
+
+    if not storage.transact([path[FILE_PATH_STOCK], path[FILE_PATH_RESERVATION]], build, "Auto Reservation Exec"):
+        return None
+    return executed[0] if executed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="予約日が来た出庫予約を在庫に反映する")
+    parser.add_argument("--date", type=dt.date.fromisoformat, help="この日までの予約を実行（既定: 今日 JST）")
+    parser.add_argument("--force", action="store_true", help="この日の実行済みの印があっても実行する")
+    args = parser.parse_args(argv)
+
+    now = dt.datetime.now(JST)
+    today = args.date or now.date()
+    config = load_config()
+    # TRACE_LOG があれば、拠点ごとの所要時間・通信量を1行の JSON で stderr に出す
+    tracer = Tracer("reservation_worker", date=str(today))
+    if config.get("TRACE_LOG"):
+        configure_logging()
+    shard_map = ShardMap(config)
+    storage = create_storage(config, REPO_NAME, segmented_paths=[FILE_PATH_LOG] + shard_map.paths(FILE_PATH_LOG))
+    failed = False
+    for shard in shard_map.names:
+        label = f"{today}" + (f" [{shard}]" if shard else "")
+        paths = {f: shard_map.path(f, shard) for f in (FILE_PATH_STOCK, FILE_PATH_LOG, FILE_PATH_RESERVATION, FILE_PATH_RUNS)}
+        if not args.force and already_ran(storage, today, paths):
+            print(f"{label} は実行済みです")
+            continue
+        with tracer.span("run", shard=shard) as record:
+            count = run_due_reservations(storage, today, now.strftime("%Y-%m-%d %H:%M"), paths)
+            record["executed"] = count
+        if count is None:
+            print(f"{label} 予約の反映に失敗しました", file=sys.stderr)
+            failed = True
+            continue
+        print(f"{label}: {count} 件の予約を実行しました")
+    # SQLite の時は GitHub への同期を待たずに送っておく
+    if getattr(storage, "remote", None) is not None:
+        with tracer.span("sync"):
+            storage.sync()
+    tracer.emit()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import argparse
+import posixpath
+import sys
+
+import pandas as pd
+
+from inventory import SKU_KEYS
+from storage import concat_typed, fan_out
+
+# --- 拠点ごとのファイル分割（シャード） ---
+# 在庫・ログ・予約を拠点（地名のグループ、または取引先）ごとのファイルに分け、
+# 画面は担当の拠点のファイルだけを読み書きする。別の拠点の更新とは sha がぶつからない。
+# secrets に SHARDS が無ければ分割せず、従来どおりの1ファイル（シャード名 ""）で動く。
+#
+#   SHARD_BY = "地名"          # 振り分けに使う列（"地名" か "取引先"）
+#   [SHARDS]
+#   "東日本" = ["青森", "仙台"]   # シャード名 = その列の値の一覧（TOML なので日本語のキーは引用符で囲む）
+#   "西日本" = ["大阪", "福岡"]
+#
+# ファイルは shards/<シャード名>/inventory_main.csv のように置く。どのグループにも無い値は DEFAULT_SHARD へ。
+# 振り分けは新規登録の時に決まり、その後に地名を変えても行は元のシャードに残る。
+# 既存の1ファイルからの移行: python -m shards --migrate
+
+SHARD_DIR = "shards"
+DEFAULT_SHARD = "その他"
+DEFAULT_SHARD_BY = "地名"
+
+
+class ShardMap:
+    def __init__(self, config):
+        groups = dict(config.get("SHARDS", {}) or {})
+        self.by = config.get("SHARD_BY", DEFAULT_SHARD_BY)
+        self.names = list(groups) + [DEFAULT_SHARD] if groups else [""]
+        self._lookup = {str(v): name for name, values in groups.items() for v in values}
+
+    @property
+    def enabled(self):
+        return self.names != [""]
+
+    def shard_of(self, value):
+        if not self.enabled:
+            return ""
+        return self._lookup.get(str(value), DEFAULT_SHARD)
+
+    def path(self, file_path, shard):
+        return posixpath.join(SHARD_DIR, shard, file_path) if shard else file_path
+
+    def paths(self, file_path, shards=None):
+        return [self.path(file_path, s) for s in (self.names if shards is None else shards)]
+
+    def split(self, df, owners=None):
+        # {シャード名: その行だけの DataFrame}。行の無いシャードも空の表で返す。
+        # 振り分け列の無い表（ログ・予約を取引先で分ける時）は、owners {SKU: シャード名} で在庫表の行に合わせる
+        if not self.enabled:
+            return {"": df}
+        if df.empty:
+            shard = pd.Series(dtype=object)
+        elif self.by in df.columns:
+            shard = df[self.by].map(self.shard_of)
+        else:
+            shard = pd.Series([owners.get(sku, DEFAULT_SHARD) for sku in zip(*(df[k] for k in SKU_KEYS))], index=df.index)
+        return {s: df[(shard == s).to_numpy()] for s in self.names}
+
+    def owners(self, df_stock):
+        return {sku: self.shard_of(v) for sku, v in zip(zip(*(df_stock[k] for k in SKU_KEYS)), df_stock[self.by])}
+
+
+def read_all(storage, shard_map, file_path, shards=None, typed=False, label=None):
+    # 複数シャードの同じファイルを並列に読み、1つの表にまとめる（拠点をまたぐ一覧・分析用）。
+    # label を渡すと、その列にシャード名を入れる
+    read = storage.read_typed if typed else storage.read
+    shards = shard_map.names if shards is None else shards
+    results = fan_out(lambda shard: read(shard_map.path(file_path, shard))[0], shards)
+    frames = [df.assign(**{label: shard}) if label and not df.empty else df for shard, df in results.items()]
+    if typed:
+        return concat_typed(frames)
+    frames = [f for f in frames if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def migrate(storage, shard_map, file_paths, message="Split into shards"):
+    # 1ファイルの在庫・ログ・予約を、振り分け列に従ってシャードのファイルへ1回のコミットで書き分ける。
+    # file_paths の先頭は在庫表（振り分け列の無い表は在庫表の行に合わせる）。元のファイルは残す（確認してから手で消す）
+    def build(frames):
+        changes = {}
+        owners = shard_map.owners(frames[file_paths[0]])
+        for file_path in file_paths:
+            for shard, part in shard_map.split(frames[file_path], owners).items():
+                changes[shard_map.path(file_path, shard)] = ("write", part.reset_index(drop=True))
+        return changes
+
+    return storage.transact(list(file_paths), build, message)
+
+
+def main(argv=None):
+    from reservation_worker import FILE_PATH_LOG, FILE_PATH_RESERVATION, FILE_PATH_STOCK, REPO_NAME, load_config
+    from storage import create_storage
+
+    parser = argparse.ArgumentParser(description="在庫・ログ・予約を拠点ごとのファイルに分ける")
+    parser.add_argument("--migrate", action="store_true", help="1ファイルのデータをシャードへ書き分ける")
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    shard_map = ShardMap(config)
+    if not shard_map.enabled:
+        print("secrets に SHARDS がありません", file=sys.stderr)
+        return 1
+    if not args.migrate:
+        print("\n".join(shard_map.names))
+        return 0
+    storage = create_storage(config, REPO_NAME, segmented_paths=[FILE_PATH_LOG] + shard_map.paths(FILE_PATH_LOG))
+    if not migrate(storage, shard_map, [FILE_PATH_STOCK, FILE_PATH_LOG, FILE_PATH_RESERVATION]):
+        print("書き分けに失敗しました", file=sys.stderr)
+        return 1
+    if getattr(storage, "remote", None) is not None:
+        storage.sync()
+    print(f"{len(shard_map.names)} シャードに書き分けました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,950 @@
+import base64
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+from archive import (
+    ARCHIVE_DIR, INDEX_NAME, block_entry, block_name, decode_block, decode_index,
+    encode_block, encode_index, overlapping, split_closed,
+)
+
+# --- ストレージ層 ---
+# app.py / analysis.py は read / read_typed / read_range / write / append / transact だけを使う。
+# GitHub を DB として使う従来方式と、ローカル SQLite を DB にして GitHub へは定期同期する方式を切り替えられる。
+
+GITHUB_API = "https://api.github.com"
+DEFAULT_SQLITE_PATH = "zaiko.db"
+DEFAULT_SYNC_INTERVAL = 600  # 秒
+TX_RETRIES = 4
+TX_BACKOFF = 0.5  # 秒。衝突のたびに倍にして、同時に再試行しないよう揺らぎを足す
+# 並列に読む時のスレッド数と、GitHub への keep-alive 接続の数（スレッド数以上にしておく）
+FAN_OUT_WORKERS = 8
+HTTP_POOL_SIZE = 16
+# 入出庫ログの型。CSV を fillna("") すると数値列まで object になるので、ログは型を付けて持つ
+LOG_CATEGORY_COLUMNS = ["商品名", "サイズ", "地名", "区分", "担当者"]
+LOG_INT_COLUMNS = ["数量", "在庫数"]
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M"
+JST = dt.timezone(dt.timedelta(hours=9))
+
+
+def _read_csv_text(csv_text):
+    return pd.read_csv(StringIO(csv_text)).fillna("")
+
+
+def _git_blob_sha(data):
+    # GitHub が返す sha と同じ値（git hash-object）
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def to_typed_log(df):
+    # 日時 → datetime64、数量/在庫数 → Int64（空欄は <NA>）、繰り返しの多い文字列列 → category
+    if df.empty:
+        return df
+    df = df.copy()
+    if "日時" in df:
+        df["日時"] = pd.to_datetime(df["日時"], errors="coerce")
+    for c in LOG_INT_COLUMNS:
+        if c in df:
+            df[c] = pd.to_numeric(df[c], errors="coerce").round().astype("Int64")
+    for c in LOG_CATEGORY_COLUMNS:
+        if c in df:
+            df[c] = df[c].astype(str).astype("category")
+    return df
+
+
+def fan_out(func, items, workers=FAN_OUT_WORKERS):
+    # items の各要素に func を並列に当て、{要素: 結果} を返す（GitHub への読み込みは I/O 待ちなのでスレッドで足りる）
+    items = list(items)
+    if len(items) <= 1:
+        return {item: func(item) for item in items}
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return dict(zip(items, pool.map(func, items)))
+
+
+def untyped_log(df):
+    # to_typed_log の逆。アーカイブから読んだ行を CSV / SQLite と同じ形（文字列、空欄は ""）に戻す
+    if df.empty:
+        return df
+    df = df.copy()
+    for c in df.columns:
+        if c == "日時":
+            df[c] = df[c].dt.strftime(LOG_TIME_FORMAT).fillna("")
+        elif isinstance(df[c].dtype, pd.CategoricalDtype) or c in LOG_INT_COLUMNS:
+            df[c] = df[c].astype(object).where(df[c].notna(), "")
+    return df
+
+
+def concat_typed(frames, category_columns=LOG_CATEGORY_COLUMNS):
+    # category 列はカテゴリをそろえてから結合する（そろえないと object に戻ってしまう）
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    for c in category_columns:
+        if all(c in f for f in frames):
+            cats = pd.api.types.union_categoricals([f[c] for f in frames]).categories
+            frames = [f.assign(**{c: f[c].cat.set_categories(cats)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def encode_snapshot(df, source_sha):
+    # 型付きログを Parquet にする。元にした CSV の blob sha をメタデータに入れておき、読む時に照合する
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # 雑多な列（詳細・出荷先など）は数値と空欄が混ざるので、archive.encode_block と同じく文字列にそろえる
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].astype(str)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"source_sha": source_sha.encode()})
+    buf = BytesIO()
+    pq.write_table(table, buf, compression="zstd")
+    return buf.getvalue()
+
+
+def decode_snapshot(data):
+    # (DataFrame, 元にした CSV の sha) を返す
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(BytesIO(data))
+    source_sha = (table.schema.metadata or {}).get(b"source_sha", b"").decode()
+    return table.to_pandas(), source_sha
+
+
+def _in_range(ts, start=None, end=None):
+    mask = pd.Series(True, index=ts.index)
+    if start is not None:
+        mask &= ts >= pd.Timestamp(start)
+    if end is not None:
+        mask &= ts < pd.Timestamp(end)
+    return mask
+
+
+def _to_db_value(v):
+    # SQLite にそのまま入る型以外（Timestamp, date など）は文字列で保存する
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return None
+    if isinstance(v, (bool, int, float, str)):
+        return v
+    if isinstance(v, (pd.Timestamp, dt.datetime)):
+        return v.strftime("%Y-%m-%d %H:%M")
+    if hasattr(v, "item"):
+        return v.item()
+    return str(v)
+
+
+class RemoteError(Exception):
+    # GitHub が「無い」(404) 以外の理由で読めなかった（障害・レート制限など）
+    pass
+
+
+class GitHubStorage:
+    # GitHub Contents API をそのまま DB として使う（1ファイル = 1テーブル）
+    # segmented_paths に入っているファイルは追記専用ログとして扱い、
+    # 追記分は「ファイル名/YYYY-MM.csv」の月次セグメントにだけ書き込む。
+    # 読み込んだファイルは {パス: (ETag, sha, DataFrame)} で覚えておき、次回は If-None-Match で確認する。
+    # 304 が返れば本文のダウンロードも CSV の解析もせずに前回の DataFrame を使い回す。
+    def __init__(self, repo_name, token, segmented_paths=(), branch=None):
+        self.repo_name = repo_name
+        self.token = token
+        self.segmented_paths = set(segmented_paths)
+        self.branch = branch
+        self._cache = {}
+        self._typed_cache = {}
+        # 接続は使い回す（毎回の TLS ハンドシェイクを省く）。並列読み込みでも足りるだけ接続を持つ
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+        # アーカイブのブロック（Parquet の bytes）を {パス: (sha, bytes)} で覚えておく
+        self._blob_cache = {}
+
+    def _url(self, file_path):
+        return f"{GITHUB_API}/repos/{self.repo_name}/contents/{file_path}"
+
+    def _headers(self):
+        return {"Authorization": f"token {self.token}"}
+
+    def _http(self, method, url, **kwargs):
+        # HTTP はすべてここを通す（計測中なら回数・受信量・304 の数を span に足す）
+        res = self.session.request(method, url, **kwargs)
+        tracing.add("requests", 1)
+        tracing.add("bytes", len(res.content or b""))
+        if res.status_code == 304:
+            tracing.add("not_modified", 1)
+        return res
+
+    def _api(self, method, path, **kwargs):
+        # Git Data API（git/refs, git/trees, git/commits）用
+        url = f"{GITHUB_API}/repos/{self.repo_name}" + (f"/{path}" if path else "")
+        return self._http(method, url, headers=self._headers(), **kwargs)
+
+    @staticmethod
+    def _check_missing(res, path, strict):
+        # strict の時は、404（本当に無い）以外の失敗を空として扱わずに例外にする
+        if strict and res.status_code not in (200, 304, 404):
+            raise RemoteError(f"{path}: HTTP {res.status_code}")
+
+    def _read_file(self, file_path, ref=None, strict=False):
+        headers = self._headers()
+        cached = self._cache.get(file_path)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        res = self._http("GET", self._url(file_path), headers=headers, params={"ref": ref} if ref else None)
+        if res.status_code == 304 and cached:
+            # 呼び出し側が列を書き換えてもキャッシュが壊れないようにコピーを返す
+            return cached[2].copy(), cached[1]
+        if res.status_code == 200:
+            content = res.json()
+            if cached and cached[1] == content["sha"]:
+                # ETag だけ変わって中身（blob）が同じなら解析し直さない
+                df = cached[2]
+            else:
+                csv_text = base64.b64decode(content["content"]).decode("utf-8")
+                df = _read_csv_text(csv_text)
+            if res.headers.get("ETag"):
+                self._cache[file_path] = (res.headers["ETag"], content["sha"], df)
+            return df.copy(), content["sha"]
+        self._cache.pop(file_path, None)
+        self._check_missing(res, file_path, strict)
+        return pd.DataFrame(), None
+
+    def _put(self, file_path, content, sha, message):
+        data = {
+            "message": message,
+            "content": base64.b64encode(content).decode("utf-8"),
+        }
+        # sha なしの PUT は新規ファイル作成
+        if sha:
+            data["sha"] = sha
+        tracing.add("bytes_out", len(content))
+        res = self._http("PUT", self._url(file_path), headers=self._headers(), json=data)
+        # 成否に関わらず捨てる（失敗時は他の人の更新が入っている可能性が高い）
+        self.invalidate(file_path)
+        return res.status_code in (200, 201)
+
+    def _write_file(self, file_path, df, sha, message):
+        return self._put(file_path, df.to_csv(index=False).encode("utf-8"), sha, message)
+
+    def _delete_file(self, file_path, sha, message):
+        res = self._http("DELETE", self._url(file_path), headers=self._headers(), json={"message": message, "sha": sha})
+        self.invalidate(file_path)
+        return res.status_code == 200
+
+    def invalidate(self, file_path):
+        # ファイル本体と、それが入っているセグメント一覧のキャッシュを捨てる
+        self._cache.pop(file_path, None)
+        self._cache.pop(os.path.dirname(file_path), None)
+
+    # --- 月次セグメント ---
+    @staticmethod
+    def _segment_dir(file_path):
+        return os.path.splitext(file_path)[0]
+
+    @classmethod
+    def _current_segment(cls, file_path):
+        month = dt.datetime.now(JST).strftime("%Y-%m")
+        return f"{cls._segment_dir(file_path)}/{month}.csv"
+
+    def _list_dir(self, dir_path, ref=None, strict=False):
+        # [(パス, sha), ...] をパス順に返す。一覧も ETag で再検証する
+        headers = self._headers()
+        cached = self._cache.get(dir_path)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        res = self._http("GET", self._url(dir_path), headers=headers, params={"ref": ref} if ref else None)
+        if res.status_code == 304 and cached:
+            return cached[1]
+        if res.status_code != 200 or not isinstance(res.json(), list):
+            self._cache.pop(dir_path, None)
+            self._check_missing(res, dir_path, strict)
+            return []
+        items = sorted((f["path"], f["sha"]) for f in res.json() if f["type"] == "file")
+        if res.headers.get("ETag"):
+            self._cache[dir_path] = (res.headers["ETag"], items)
+        return items
+
+    def list_segments(self, file_path, ref=None, strict=False):
+        # 古い月から順に返す
+        return [(p, sha) for p, sha in self._list_dir(self._segment_dir(file_path), ref, strict) if p.endswith(".csv")]
+
+    def iter_segments(self, file_path, newest_first=False):
+        # セグメントを1つずつ読む。必要な期間だけ読んで止められるようにジェネレータにしている
+        segments = self.list_segments(file_path)
+        if newest_first:
+            segments = segments[::-1]
+        for seg_path, _ in segments:
+            df, _ = self._read_file(seg_path)
+            yield seg_path, df
+
+    def read(self, file_path, ref=None, strict=False):
+        # 追記専用ログはアーカイブ（締めた月）+ 本体 + セグメント。sha の「#」の後ろはアーカイブの index.json の sha。
+        # strict なら、一部でも取れなかった時に欠けたまま返さず RemoteError にする
+        df, sha = self._read_open(file_path, ref, strict)
+        if file_path not in self.segmented_paths:
+            return df, sha
+        archived, index_sha = self._read_archive(file_path, ref=ref, strict=strict)
+        if index_sha is None:
+            return df, sha
+        return pd.concat([untyped_log(archived), df], ignore_index=True).fillna(""), f"{sha or ''}#{index_sha}"
+
+    def _read_open(self, file_path, ref=None, strict=False):
+        # アーカイブしていない分（本体 + セグメント）
+        df, sha = self._read_file(file_path, ref, strict)
+        if file_path not in self.segmented_paths:
+            return df, sha
+        segments = self.list_segments(file_path, ref, strict)
+        if not segments:
+            return df, sha
+        # セグメントは互いに独立なので並列に取る
+        seg_frames = fan_out(lambda seg_path: self._read_file(seg_path, ref, strict)[0], [seg_path for seg_path, _ in segments])
+        frames = [df] + list(seg_frames.values())
+        # sha は本体と各セグメントの sha をつないだもの（どれかが変われば別物になる）
+        combined_sha = "|".join([sha or ""] + [seg_sha for _, seg_sha in segments])
+        return pd.concat(frames, ignore_index=True).fillna(""), combined_sha
+
+    def write(self, file_path, df, sha, message, retries=TX_RETRIES):
+        if file_path not in self.segmented_paths:
+            return self._write_file(file_path, df, sha, message)
+        # ログ全体の書き換えは本体へ集約（コンパクション）してセグメントとアーカイブを消す（アーカイブの分も df に入っている）。
+        # head 時点の版が読んだ時のままか確かめてから1コミットで行うので、途中で追記が入っても行が二重にならない
+        branch = self._default_branch()
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(TX_BACKOFF * 2 ** (attempt - 1) * (1 + random.random()))
+            res = self._api("GET", f"git/ref/heads/{branch}")
+            if res.status_code != 200:
+                continue
+            head = res.json()["object"]["sha"]
+            segments = self.list_segments(file_path, ref=head)
+            archived = self._list_dir(self._archive_dir(file_path), ref=head)
+            # sha が None なら「まだ無いはず」の意味（Contents API の sha なし PUT と同じ）
+            if (self._log_sha(file_path, segments, archived, ref=head) or None) != (sha or None):
+                return False
+            deleted = [path for path, _ in segments + archived]
+            ok = self._commit_files(head, {file_path: df}, deleted, message)
+            for path in [file_path] + deleted:
+                self.invalidate(path)
+            if ok:
+                self._write_snapshot(file_path, df, _git_blob_sha(df.to_csv(index=False).encode("utf-8")), message)
+                return True
+        return False
+
+    def _log_sha(self, file_path, segments, archived, ref=None, strict=False):
+        # read() が返すのと同じ形の版（本体|セグメント...#index.json）
+        sha = self._read_file(file_path, ref, strict)[1]
+        if segments:
+            sha = "|".join([sha or ""] + [seg_sha for _, seg_sha in segments])
+        index_sha = dict(archived).get(self._archive_index(file_path))
+        return f"{sha or ''}#{index_sha}" if index_sha else sha
+
+    def version(self, file_path, strict=False):
+        # read() が返すのと同じ sha を、セグメントやアーカイブの中身は取りに行かずに求める
+        if file_path not in self.segmented_paths:
+            return self._read_file(file_path, strict=strict)[1]
+        segments = self.list_segments(file_path, strict=strict)
+        archived = self._list_dir(self._archive_dir(file_path), strict=strict)
+        return self._log_sha(file_path, segments, archived, strict=strict)
+
+    # --- 型付きスナップショット（本体 CSV と同じ内容の Parquet） ---
+    @staticmethod
+    def _snapshot_path(file_path):
+        return os.path.splitext(file_path)[0] + ".parquet"
+
+    def _write_snapshot(self, file_path, df, source_sha, message):
+        # 失敗しても CSV に戻って読むだけなので、結果は気にしない（CSV の書き込みは済んでいる）
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return False
+        try:
+            content = encode_snapshot(to_typed_log(df), source_sha)
+        except pa.ArrowException:
+            return False
+        snap_path = self._snapshot_path(file_path)
+        snap_sha = dict(self._list_dir(os.path.dirname(file_path))).get(snap_path)
+        return self._put(snap_path, content, snap_sha, message)
+
+    def _read_snapshot(self, file_path):
+        # 本体 CSV の今の sha から作られたスナップショットがあれば (DataFrame, sha) を、無ければ (None, sha) を返す
+        listing = dict(self._list_dir(os.path.dirname(file_path)))
+        base_sha, snap_path = listing.get(file_path), self._snapshot_path(file_path)
+        snap_sha = listing.get(snap_path)
+        if not base_sha or not snap_sha:
+            return None, base_sha
+        cached = self._typed_cache.get(snap_path)
+        if cached and cached[0] == snap_sha:
+            df, source_sha = cached[1], cached[2]
+        else:
+            # 1MB を超えると Contents API は本文を返さないので raw で取る
+            headers = {**self._headers(), "Accept": "application/vnd.github.raw"}
+            res = self._http("GET", self._url(snap_path), headers=headers)
+            if res.status_code != 200:
+                return None, base_sha
+            try:
+                import pyarrow as pa
+            except ImportError:
+                return None, base_sha
+            try:
+                df, source_sha = decode_snapshot(res.content)
+            except pa.ArrowException:
+                return None, base_sha
+            self._typed_cache[snap_path] = (snap_sha, df, source_sha)
+        return (df if source_sha == base_sha else None), base_sha
+
+    def read_typed(self, file_path):
+        # ログを型付きで読む。アーカイブのブロックはそのまま型付きで、残りは _read_open_typed で
+        df, sha = self._read_open_typed(file_path)
+        if file_path not in self.segmented_paths:
+            return df, sha
+        archived, index_sha = self._read_archive(file_path)
+        if index_sha is None:
+            return df, sha
+        return concat_typed([archived, df]), f"{sha or ''}#{index_sha}"
+
+    def read_range(self, file_path, start=None, end=None):
+        # start <= 日時 < end の行だけを型付きで読む。アーカイブは期間に重なる月のブロックしか取りに行かない。
+        # sha は read_typed と同じ（期間によらずデータ全体の版）
+        df, sha = self._read_open_typed(file_path)
+        if not df.empty:
+            df = df[_in_range(df["日時"], start, end)]
+        if file_path not in self.segmented_paths:
+            return df, sha
+        archived, index_sha = self._read_archive(file_path, start, end)
+        if index_sha is None:
+            return df, sha
+        return concat_typed([archived, df]), f"{sha or ''}#{index_sha}"
+
+    def time_span(self, file_path):
+        # ログの最初と最後の日時。アーカイブは index.json の min / max だけを見て、ブロックは取りに行かない
+        df, _ = self._read_open_typed(file_path)
+        times = [df["日時"].min(), df["日時"].max()] if not df.empty else []
+        if file_path in self.segmented_paths:
+            listing = dict(self._list_dir(self._archive_dir(file_path)))
+            index_path = self._archive_index(file_path)
+            if index_path in listing:
+                for e in decode_index(self._read_blob(index_path, listing[index_path])):
+                    times += [pd.Timestamp(e["min"]), pd.Timestamp(e["max"])]
+        times = [t for t in times if pd.notna(t)]
+        return (min(times), max(times)) if times else (None, None)
+
+    def _read_open_typed(self, file_path):
+        # 本体はスナップショットを優先し、無い・古い時は CSV を変換する。
+        # 変換結果は sha ごとに覚えておくので、変わっていなければ再変換しない
+        base, base_sha = self._read_snapshot(file_path)
+        if base is None:
+            df, sha = self._read_open(file_path)
+            cached = self._typed_cache.get(file_path)
+            if not (cached and cached[0] == sha):
+                cached = (sha, to_typed_log(df))
+                self._typed_cache[file_path] = cached
+            return cached[1].copy(), sha
+        segments = self.list_segments(file_path) if file_path in self.segmented_paths else []
+        seg_frames = fan_out(lambda seg_path: to_typed_log(self._read_file(seg_path)[0]), [seg_path for seg_path, _ in segments])
+        frames = [base] + list(seg_frames.values())
+        sha = "|".join([base_sha] + [seg_sha for _, seg_sha in segments]) if segments else base_sha
+        return concat_typed(frames), sha
+
+    # --- 締めた月のアーカイブ（archive.py） ---
+    def _archive_dir(self, file_path):
+        return f"{self._segment_dir(file_path)}/{ARCHIVE_DIR}"
+
+    def _archive_index(self, file_path):
+        return f"{self._archive_dir(file_path)}/{INDEX_NAME}"
+
+    def _read_blob(self, path, sha, ref=None, strict=False):
+        # 中身を bytes のまま取る（sha が変わっていなければ取りに行かない）
+        cached = self._blob_cache.get(path)
+        if cached and cached[0] == sha:
+            return cached[1]
+        headers = {**self._headers(), "Accept": "application/vnd.github.raw"}
+        res = self._http("GET", self._url(path), headers=headers, params={"ref": ref} if ref else None)
+        if res.status_code != 200:
+            self._check_missing(res, path, strict)
+            return b""
+        self._blob_cache[path] = (sha, res.content)
+        return res.content
+
+    def _read_archive(self, file_path, start=None, end=None, ref=None, strict=False):
+        # (期間に重なるブロックの行, index.json の sha)。アーカイブが無ければ (空, None)
+        archive_dir, index_path = self._archive_dir(file_path), self._archive_index(file_path)
+        listing = dict(self._list_dir(archive_dir, ref, strict))
+        if index_path not in listing:
+            return pd.DataFrame(), None
+        entries = overlapping(decode_index(self._read_blob(index_path, listing[index_path], ref, strict)), start, end)
+        paths = [f"{archive_dir}/{e['path']}" for e in entries if f"{archive_dir}/{e['path']}" in listing]
+        blocks = fan_out(lambda path: decode_block(self._read_blob(path, listing[path], ref, strict), start, end), paths)
+        return concat_typed(list(blocks.values())), listing[index_path]
+
+    def archive(self, file_path, before=None, message="Archive closed months", retries=TX_RETRIES):
+        # before（既定: 今月1日 JST）より前の行を月ごとのブロックへ移し、本体 CSV には残りだけを書いてセグメントを消す。
+        # 既にその月のブロックがあれば足し込む。全部を1コミットで行い、衝突したら読み直してやり直す
+        before = pd.Timestamp(before) if before is not None else pd.Timestamp(dt.datetime.now(JST).strftime("%Y-%m-01"))
+        archive_dir, index_path = self._archive_dir(file_path), self._archive_index(file_path)
+        branch = self._default_branch()
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(TX_BACKOFF * 2 ** (attempt - 1) * (1 + random.random()))
+            res = self._api("GET", f"git/ref/heads/{branch}")
+            if res.status_code != 200:
+                continue
+            head = res.json()["object"]["sha"]
+            df_open, _ = self._read_open(file_path, ref=head)
+            if df_open.empty:
+                return True
+            months, df_keep = split_closed(df_open, before)
+            if not months:
+                return True
+            listing = dict(self._list_dir(archive_dir, ref=head))
+            entries = {}
+            if index_path in listing:
+                entries = {e["month"]: e for e in decode_index(self._read_blob(index_path, listing[index_path], head))}
+            files = {}
+            for month, rows in months.items():
+                block_path = f"{archive_dir}/{block_name(month)}"
+                block = to_typed_log(rows)
+                if block_path in listing:
+                    block = concat_typed([decode_block(self._read_blob(block_path, listing[block_path], head)), block])
+                files[block_path] = encode_block(block)
+                entries[month] = block_entry(month, block)
+            files[index_path] = encode_index(list(entries.values()))
+            files[file_path] = df_keep
+            deleted = [seg_path for seg_path, _ in self.list_segments(file_path, ref=head)]
+            ok = self._commit_files(head, files, deleted, message)
+            for path in list(files) + deleted:
+                self.invalidate(path)
+            if ok:
+                self._write_snapshot(file_path, df_keep, _git_blob_sha(df_keep.to_csv(index=False).encode("utf-8")), message)
+                return True
+        return False
+
+    def append(self, file_path, df_rows, message):
+        if file_path in self.segmented_paths:
+            # 今月のセグメントだけを書き換える（書き込み量は履歴全体ではなく当月分に比例）
+            seg_path = self._current_segment(file_path)
+            df_seg, sha_seg = self._read_file(seg_path)
+            return self._write_file(seg_path, pd.concat([df_seg, df_rows], ignore_index=True), sha_seg, message)
+        # 行単位の操作は GitHub では「読む → 書き換える → 全体を PUT」になる
+        df, sha = self.read(file_path)
+        return self.write(file_path, pd.concat([df, df_rows], ignore_index=True), sha, message)
+
+    # --- 複数ファイルをまとめて1コミットで更新する ---
+    def _default_branch(self):
+        if self.branch is None:
+            res = self._api("GET", "")
+            self.branch = res.json().get("default_branch", "main") if res.status_code == 200 else "main"
+        return self.branch
+
+    def _commit_files(self, head, files, deleted, message):
+        # files: {パス: DataFrame（CSV にする） | bytes（そのまま）}, deleted: [パス]。
+        # head の上に1コミット作り、fast-forward の時だけブランチを進める
+        res = self._api("GET", f"git/commits/{head}")
+        if res.status_code != 200:
+            return False
+        base_tree = res.json()["tree"]["sha"]
+        entries = []
+        for p, content in files.items():
+            if isinstance(content, bytes):
+                # バイナリ（アーカイブのブロック）は先に blob を作って sha で指す
+                tracing.add("bytes_out", len(content))
+                res = self._api("POST", "git/blobs", json={"content": base64.b64encode(content).decode("utf-8"), "encoding": "base64"})
+                if res.status_code != 201:
+                    return False
+                entries.append({"path": p, "mode": "100644", "type": "blob", "sha": res.json()["sha"]})
+            else:
+                text = content.to_csv(index=False)
+                tracing.add("bytes_out", len(text.encode("utf-8")))
+                entries.append({"path": p, "mode": "100644", "type": "blob", "content": text})
+        entries += [{"path": p, "mode": "100644", "type": "blob", "sha": None} for p in deleted]
+        res = self._api("POST", "git/trees", json={"base_tree": base_tree, "tree": entries})
+        if res.status_code != 201:
+            return False
+        res = self._api("POST", "git/commits", json={"message": message, "tree": res.json()["sha"], "parents": [head]})
+        if res.status_code != 201:
+            return False
+        # 他の人が先にコミットしていれば 422（non-fast-forward）になる
+        res = self._api("PATCH", f"git/refs/heads/{self._default_branch()}", json={"sha": res.json()["sha"], "force": False})
+        return res.status_code == 200
+
+    def transact(self, file_paths, build, message, retries=TX_RETRIES):
+        # build(frames) は {パス: 最新の DataFrame} を受け取り {パス: ("write", df) | ("append", 追加行)} を返す。
+        # 衝突したら最新の状態を読み直して build をやり直す（＝差分を最新の在庫に載せ直す）。
+        # 在庫・ログ・予約の変更は Git Data API で1コミットにまとめるので、一部だけ反映されることはない。
+        branch = self._default_branch()
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(TX_BACKOFF * 2 ** (attempt - 1) * (1 + random.random()))
+            res = self._api("GET", f"git/ref/heads/{branch}")
+            if res.status_code != 200:
+                continue
+            head = res.json()["object"]["sha"]
+            # head 時点の内容を読む（CDN の古い内容の上に積まないように ref を固定する）
+            frames = {p: self.read(p, ref=head)[0] for p in file_paths}
+            changes = build(frames)
+            if not changes:
+                return True
+            files, deleted = {}, []
+            for path, (kind, df) in changes.items():
+                if kind == "append" and path in self.segmented_paths:
+                    seg_path = self._current_segment(path)
+                    files[seg_path] = pd.concat([self._read_file(seg_path, ref=head)[0], df], ignore_index=True)
+                elif kind == "append":
+                    base = frames[path] if path in frames else self.read(path, ref=head)[0]
+                    files[path] = pd.concat([base, df], ignore_index=True)
+                else:
+                    files[path] = df
+                    if path in self.segmented_paths:
+                        # 全体の書き換えなので、セグメントもアーカイブも本体に畳む
+                        deleted += [seg_path for seg_path, _ in self.list_segments(path, ref=head)]
+                        deleted += [p for p, _ in self._list_dir(self._archive_dir(path), ref=head)]
+            ok = self._commit_files(head, files, deleted, message)
+            for path in list(files) + deleted:
+                self.invalidate(path)
+            if ok:
+                return True
+        return False
+
+
+class SQLiteStorage:
+    # ローカル SQLite を DB にする。1ファイル = 1テーブル、列は型なしで値の型をそのまま保持する。
+    # sha の代わりにテーブルごとの版番号を返し、write 時の楽観ロックに使う。
+    # remote(GitHubStorage) があれば初回はそこから取り込み、以後は sync_interval ごとに書き戻す。
+    # 読み込んだ DataFrame は版番号と一緒に覚えておき、版が変わっていなければ SELECT し直さない。
+    def __init__(self, db_path=DEFAULT_SQLITE_PATH, remote=None, seed_dir=".", sync_interval=DEFAULT_SYNC_INTERVAL):
+        self.db_path = db_path
+        self.remote = remote
+        self.seed_dir = seed_dir
+        self.sync_interval = sync_interval
+        self.last_sync = time.time()
+        self._lock = threading.Lock()
+        # 書き込みが途切れても未送信の分が残らないよう、次の同期時刻に1本だけタイマーを置く
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        # タイマーと書き込み側の両方から sync が呼ばれるので、同時には1つだけ走らせる
+        self._sync_lock = threading.Lock()
+        self._cache = {}
+        self._typed_cache = {}
+        with self._connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS _meta (file_path TEXT PRIMARY KEY, version INTEGER, dirty INTEGER)")
+            # synced_rows: GitHub に送り済みの行数 / rewritten: 前回同期後に追記以外の変更があったか
+            # remote_sha: 最後に取り込んだ・送った時の GitHub 側の sha（"" は GitHub に無かった、NULL は不明）
+            meta_cols = [r[1] for r in con.execute("PRAGMA table_info(_meta)")]
+            if "synced_rows" not in meta_cols:
+                con.execute("ALTER TABLE _meta ADD COLUMN synced_rows INTEGER DEFAULT 0")
+                con.execute("ALTER TABLE _meta ADD COLUMN rewritten INTEGER DEFAULT 1")
+            if "remote_sha" not in meta_cols:
+                con.execute("ALTER TABLE _meta ADD COLUMN remote_sha TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def _table(file_path):
+        return '"' + file_path.replace('"', '""') + '"'
+
+    @staticmethod
+    def _col(name):
+        return '"' + str(name).replace('"', '""') + '"'
+
+    def _version(self, con, file_path):
+        row = con.execute("SELECT version FROM _meta WHERE file_path = ?", (file_path,)).fetchone()
+        return row[0] if row else None
+
+    def _bump(self, con, file_path, rewritten=True):
+        # 取り込み済みでない表を作る時は GitHub にも無かったものとして扱う
+        con.execute(
+            "INSERT INTO _meta (file_path, version, dirty, synced_rows, rewritten, remote_sha) VALUES (?, 1, 1, 0, 1, '') "
+            "ON CONFLICT(file_path) DO UPDATE SET version = version + 1, dirty = 1, rewritten = MAX(rewritten, ?)",
+            (file_path, int(rewritten)),
+        )
+
+    def _columns(self, con, file_path):
+        return [r[1] for r in con.execute(f"PRAGMA table_info({self._table(file_path)})")]
+
+    def _ensure_columns(self, con, file_path, columns):
+        existing = self._columns(con, file_path)
+        if not existing:
+            if not columns:
+                return
+            cols = ", ".join(self._col(c) for c in columns)
+            con.execute(f"CREATE TABLE {self._table(file_path)} ({cols})")
+            return
+        for c in columns:
+            if c not in existing:
+                con.execute(f"ALTER TABLE {self._table(file_path)} ADD COLUMN {self._col(c)}")
+
+    def _insert(self, con, file_path, df):
+        if df.empty:
+            return
+        self._ensure_columns(con, file_path, list(df.columns))
+        cols = ", ".join(self._col(c) for c in df.columns)
+        marks = ", ".join("?" for _ in df.columns)
+        rows = [tuple(_to_db_value(v) for v in r) for r in df.astype(object).itertuples(index=False, name=None)]
+        con.executemany(f"INSERT INTO {self._table(file_path)} ({cols}) VALUES ({marks})", rows)
+
+    def _read_remote(self, file_path):
+        # GitHub から (DataFrame, sha) を取る。404 以外で取れない時は少し待って読み直し、それでも駄目なら RemoteError
+        for attempt in range(TX_RETRIES + 1):
+            if attempt:
+                time.sleep(TX_BACKOFF * 2 ** (attempt - 1) * (1 + random.random()))
+            try:
+                return self.remote.read(file_path, strict=True)
+            except RemoteError:
+                if attempt == TX_RETRIES:
+                    raise
+
+    def _seed(self, con, file_path):
+        # テーブルが無い時だけ、GitHub → リポジトリ同梱の CSV の順で初期データを探す。
+        # 同梱 CSV に頼るのは GitHub に本当に無い（404）時だけ。障害で読めない時は空で始めずに例外にする
+        df, remote_sha = pd.DataFrame(), None
+        if self.remote is not None:
+            df, remote_sha = self._read_remote(file_path)
+        from_remote = remote_sha is not None
+        if not from_remote:
+            local_path = os.path.join(self.seed_dir, file_path)
+            if os.path.exists(local_path):
+                df = pd.read_csv(local_path).fillna("")
+        if df.empty:
+            return
+        self._ensure_columns(con, file_path, list(df.columns))
+        self._insert(con, file_path, df)
+        # GitHub から取り込んだ分は送り済み、同梱 CSV から作った分は次回同期で全体を書く
+        meta = "INSERT OR REPLACE INTO _meta (file_path, version, dirty, synced_rows, rewritten, remote_sha) VALUES (?, 1, ?, ?, ?, ?)"
+        if from_remote:
+            con.execute(meta, (file_path, 0, len(df), 0, remote_sha))
+        else:
+            con.execute(meta, (file_path, 1, 0, 1, ""))
+
+    def _read(self, con, file_path):
+        if self._version(con, file_path) is None:
+            self._seed(con, file_path)
+        version = self._version(con, file_path)
+        if version is None:
+            return pd.DataFrame(), None
+        cached = self._cache.get(file_path)
+        if cached and cached[0] == version:
+            return cached[1].copy(), str(version)
+        if not self._columns(con, file_path):
+            return pd.DataFrame(), str(version)
+        cur = con.execute(f"SELECT * FROM {self._table(file_path)} ORDER BY rowid")
+        columns = [d[0] for d in cur.description]
+        df = pd.DataFrame(cur.fetchall(), columns=columns).fillna("")
+        self._cache[file_path] = (version, df)
+        return df.copy(), str(version)
+
+    def _replace(self, con, file_path, df):
+        con.execute(f"DROP TABLE IF EXISTS {self._table(file_path)}")
+        self._ensure_columns(con, file_path, list(df.columns))
+        self._insert(con, file_path, df)
+        self._bump(con, file_path)
+
+    def _write_rows(self, con, file_path, old, df):
+        # transact の "write" を、変わった行だけの UPDATE / DELETE / INSERT にする（表全体を作り直さない）。
+        # old は rowid 順に読んだ表（行ラベル 0, 1, ... が rowid の並び）。build は行ラベルを保ったまま
+        # 行を消したり値を書き換えたりするので、ラベルで突き合わせられる。突き合わせられない形なら作り直す
+        kept = df.index.isin(old.index)
+        n_kept = int(kept.sum())
+        if (
+            old.empty or list(df.columns) != list(old.columns) or not df.index.is_unique
+            or not kept[:n_kept].all() or not df.index[:n_kept].is_monotonic_increasing
+        ):
+            self._replace(con, file_path, df)
+            return
+        table = self._table(file_path)
+        rowids = [r[0] for r in con.execute(f"SELECT rowid FROM {table} ORDER BY rowid")]
+        labels = df.index[:n_kept]
+        before = old.loc[labels].astype(object).fillna("")
+        after = df.loc[labels].astype(object).fillna("")
+        changed = labels[(before != after).any(axis=1).to_numpy()]
+        removed = old.index.difference(labels)
+        sets = ", ".join(f"{self._col(c)} = ?" for c in df.columns)
+        con.executemany(
+            f"UPDATE {table} SET {sets} WHERE rowid = ?",
+            [tuple(_to_db_value(v) for v in r) + (rowids[i],) for i, r in zip(changed, df.loc[changed].astype(object).itertuples(index=False, name=None))],
+        )
+        con.executemany(f"DELETE FROM {table} WHERE rowid = ?", [(rowids[i],) for i in removed])
+        self._insert(con, file_path, df[~kept])
+        self._bump(con, file_path)
+
+    def _append(self, con, file_path, df_rows):
+        if self._version(con, file_path) is None:
+            self._seed(con, file_path)
+        self._insert(con, file_path, df_rows)
+        self._bump(con, file_path, rewritten=False)
+
+    def read(self, file_path):
+        with self._lock, self._connect() as con:
+            return self._read(con, file_path)
+
+    def read_typed(self, file_path):
+        # SQLite の値は型を保っているので、ここでは日時と category への変換だけ。版ごとに1回だけ行う
+        df, version = self.read(file_path)
+        cached = self._typed_cache.get(file_path)
+        if not (cached and cached[0] == version):
+            cached = (version, to_typed_log(df))
+            self._typed_cache[file_path] = cached
+        return cached[1].copy(), version
+
+    def read_range(self, file_path, start=None, end=None):
+        # start <= 日時 < end の行だけを SELECT する。日時は "YYYY-MM-DD HH:MM" の文字列なので文字列比較で足りる
+        with self._lock, self._connect() as con:
+            if self._version(con, file_path) is None:
+                self._seed(con, file_path)
+            version = self._version(con, file_path)
+            if version is None or "日時" not in self._columns(con, file_path):
+                return pd.DataFrame(), None if version is None else str(version)
+            table = self._table(file_path)
+            con.execute(f"CREATE INDEX IF NOT EXISTS {self._col(file_path + '_日時')} ON {table} ({self._col('日時')})")
+            where, params = [], []
+            if start is not None:
+                where.append(f"{self._col('日時')} >= ?")
+                params.append(pd.Timestamp(start).strftime(LOG_TIME_FORMAT))
+            if end is not None:
+                where.append(f"{self._col('日時')} < ?")
+                params.append(pd.Timestamp(end).strftime(LOG_TIME_FORMAT))
+            sql = f"SELECT * FROM {table}" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY rowid"
+            cur = con.execute(sql, params)
+            df = pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description]).fillna("")
+        return to_typed_log(df), str(version)
+
+    def time_span(self, file_path):
+        # ログの最初と最後の日時（日時の索引があれば MIN / MAX は索引の端を見るだけ）
+        with self._lock, self._connect() as con:
+            if self._version(con, file_path) is None:
+                self._seed(con, file_path)
+            if "日時" not in self._columns(con, file_path):
+                return None, None
+            col = self._col("日時")
+            lo, hi = con.execute(f"SELECT MIN({col}), MAX({col}) FROM {self._table(file_path)} WHERE {col} != ''").fetchone()
+        lo, hi = pd.to_datetime(lo, errors="coerce"), pd.to_datetime(hi, errors="coerce")
+        return (lo, hi) if pd.notna(lo) and pd.notna(hi) else (None, None)
+
+    def write(self, file_path, df, sha, message):
+        with self._lock, self._connect() as con:
+            version = self._version(con, file_path)
+            # 読み込み後に他の人が更新していたら GitHub の 409 と同様に失敗させる
+            if version is not None and sha is not None and str(version) != str(sha):
+                return False
+            self._replace(con, file_path, df)
+        self.maybe_sync()
+        return True
+
+    def append(self, file_path, df_rows, message):
+        with self._lock, self._connect() as con:
+            self._append(con, file_path, df_rows)
+        self.maybe_sync()
+        return True
+
+    def transact(self, file_paths, build, message, retries=TX_RETRIES):
+        # GitHubStorage.transact と同じ約束。SQLite では書き込みロック(BEGIN IMMEDIATE)を取ってから
+        # 読む → build → 書くを1トランザクションで行うので、衝突も再試行も起きない。
+        with self._lock, self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            frames = {p: self._read(con, p)[0] for p in file_paths}
+            changes = build({p: df.copy() for p, df in frames.items()})
+            for path, (kind, df) in (changes or {}).items():
+                if kind == "append":
+                    self._append(con, path, df)
+                elif path in frames:
+                    self._write_rows(con, path, frames[path], df)
+                else:
+                    self._replace(con, path, df)
+        self.maybe_sync()
+        return True
+
+    # --- GitHub への定期同期 ---
+    def maybe_sync(self):
+        # 前回の同期から sync_interval 経っていれば今送る。まだなら、その時刻に送るタイマーを置く
+        if self.remote is None:
+            return
+        wait = self.sync_interval - (time.time() - self.last_sync)
+        if wait <= 0:
+            self.sync()
+        else:
+            self._schedule_sync(wait)
+
+    def _schedule_sync(self, wait):
+        with self._timer_lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(wait, self._timed_sync)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_sync(self):
+        with self._timer_lock:
+            self._timer = None
+        self.maybe_sync()
+
+    def sync(self):
+        if self.remote is None:
+            return
+        with self._sync_lock:
+            self._sync()
+
+    def _sync(self):
+        self.last_sync = time.time()
+        with self._connect() as con:
+            dirty = [r[0] for r in con.execute("SELECT file_path FROM _meta WHERE dirty = 1")]
+        failed = False
+        for file_path in dirty:
+            # 表と送り済みの状態は同じ時点のものを使う（間に書き込みが入ると差分の起点がずれる）
+            with self._lock, self._connect() as con:
+                df, version = self._read(con, file_path)
+                synced_rows, rewritten, remote_sha = con.execute(
+                    "SELECT synced_rows, rewritten, remote_sha FROM _meta WHERE file_path = ?", (file_path,)
+                ).fetchone()
+            try:
+                # 前回取り込んだ・送った時の sha に対して書く。GitHub 側で別の変更が入っていれば上書きせず衝突にする
+                # （remote_sha が NULL なのは列を足す前の DB だけ。その時は今の sha を使う）
+                if remote_sha is None:
+                    remote_sha = self.remote.version(file_path, strict=True) or ""
+                if not rewritten and synced_rows:
+                    # 追記しかしていなければ差分の行だけを送る
+                    ok = (self.remote.version(file_path, strict=True) or "") == remote_sha and self.remote.append(
+                        file_path, df.iloc[synced_rows:], f"Sync {file_path}"
+                    )
+                else:
+                    ok = self.remote.write(file_path, df, remote_sha or None, f"Sync {file_path}")
+                new_sha = self.remote.version(file_path, strict=True) if ok else None
+            except RemoteError:
+                ok = False
+            if ok:
+                # 送った行数と GitHub の sha は必ず進める（進めないと次回の差分に送り済みの行が混ざる）。
+                # 同期中に更新が入っていれば、その分は dirty のまま次回に回す
+                with self._lock, self._connect() as con:
+                    con.execute(
+                        "UPDATE _meta SET synced_rows = ?, remote_sha = ?, "
+                        "dirty = CASE WHEN version = ? THEN 0 ELSE 1 END, "
+                        "rewritten = CASE WHEN version = ? THEN 0 ELSE rewritten END WHERE file_path = ?",
+                        (len(df), new_sha or "", int(version), int(version), file_path),
+                    )
+            else:
+                failed = True
+        # 送れなかった分は次の間隔でもう一度
+        if failed:
+            self._schedule_sync(self.sync_interval)
+
+
+def create_storage(config, repo_name, segmented_paths=()):
+    # config は st.secrets（または同じキーを持つ dict）
+    # GITHUB_TOKEN が無い時はローカル SQLite だけで動かす
+    token = config.get("GITHUB_TOKEN")
+    remote = GitHubStorage(repo_name, token, segmented_paths, config.get("GITHUB_BRANCH")) if token else None
+    if config.get("STORAGE_BACKEND", "github") == "sqlite" or remote is None:
+        return SQLiteStorage(
+            config.get("SQLITE_PATH", DEFAULT_SQLITE_PATH),
+            remote=remote,
+            sync_interval=int(config.get("GITHUB_SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL)),
+        )
+    return remote
@@ -0,0 +1,77 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 処理時間の計測 ---
+# 1回の再実行（rerun）や1回のワーカー実行ごとに Tracer を作り、重い処理を span で囲む。
+# span には 所要時間(ms) と、行数(rows)・通信量(bytes)・HTTP 回数(requests) などを付ける。
+# storage.py は add() で「今のスレッドで開いている span」に通信量を足すだけなので、計測していない時は何もしない。
+# 結果は画面のデバッグ欄に出すか、emit() で1行の JSON ログにする（本番の再実行を後から集計できる）。
+
+logger = logging.getLogger("zaiko.trace")
+_local = threading.local()
+
+
+class Tracer:
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        # with tracer.span("読み込み", path=...) as s: ... s["rows"] = len(df)
+        record = {"name": name, **attrs}
+        parent = getattr(_local, "span", None)
+        _local.span = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+            _local.span = parent
+            with self._lock:
+                self.spans.append(record)
+
+    def call(self, name, func, *args, **attrs):
+        # func(*args) を span で囲んで呼ぶ。DataFrame（または (DataFrame, sha)）を返す関数なら行数も残す
+        with self.span(name, **attrs) as record:
+            result = func(*args)
+            df = result[0] if isinstance(result, tuple) and result else result
+            if hasattr(df, "shape"):
+                record["rows"] = int(df.shape[0])
+            return result
+
+    @property
+    def total_ms(self):
+        return round((time.perf_counter() - self._start) * 1000, 2)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {"event": self.name, "ts": time.time(), "total_ms": self.total_ms, **self.attrs, "spans": spans}
+
+    def emit(self):
+        logger.info(json.dumps(self.to_dict(), ensure_ascii=False, default=str))
+
+
+def add(key, value):
+    # 今のスレッドで開いている span に数値を足す（span の外なら何もしない）
+    record = getattr(_local, "span", None)
+    if record is not None:
+        record[key] = record.get(key, 0) + value
+
+
+def configure_logging(stream=sys.stderr):
+    # JSON ログを1行ずつ出す（何度呼んでもハンドラは1つ）
+    if not logger.handlers:
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False